@@ -1,6 +1,12 @@
 import atagspace
 
-app = atagspace.app
+
+def __getattr__(name: str):
+    # app 按需从 atagspace 取得，只运行命令行时不导入 web
+    if name == "app":
+        return atagspace.app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
     atagspace.main()
@@ -1,5 +1,12 @@
 from .__main__ import main
-from .web import app
 
-app = app
 main = main
+
+
+def __getattr__(name: str):
+    # web 应用按需导入，命令行不需要加载 aiohttp
+    if name == "app":
+        from .web import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,4 @@
-from .db import Category, Tag
+from .db import Category, Tag, TagIndex
 
 
 def list_category() -> list[Category]:
@@ -33,9 +33,13 @@ def remove_tag(name: str) -> None:
     Tag.remove(name)
 
 
+def tag_index() -> TagIndex:
+    return TagIndex.get()
+
+
 def get_category_name(name: str) -> str | None:
-    return Tag.get_category_name(name)
+    return TagIndex.get().get_category_name(name)
 
 
 def get_color(name: str) -> str:
-    return Tag.get_color(name)
+    return TagIndex.get().get_color(name)
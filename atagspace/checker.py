@@ -1,37 +1,180 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, TypeVar
 import hashlib
 import logging
+import os
 
 from .db import Checksum, File
 from . import tagfile  # circular!
 
 log = logging.getLogger(__name__)
 
+F = TypeVar("F", "tagfile.ListFile", File)
 
-def check(file: "tagfile.ListFile|File", cache_only: bool = False) -> str | None:
-    if file.is_dir:
-        return None
+# 快速指纹：小于 QUICK_MIN_SIZE 的文件直接计算完整的校验和，
+# 否则读取均匀分布的 QUICK_BLOCKS 个块（包括开头和结尾），每块 QUICK_BLOCK_SIZE
+QUICK_MIN_SIZE = 4 * 1024 * 1024
+QUICK_BLOCKS = 8
+QUICK_BLOCK_SIZE = 64 * 1024
+
+
+def lookup(file: "tagfile.ListFile|File") -> tuple[str, Checksum | None]:
     realpath = tagfile.source_translate(file.path + file.name)
     existing = Checksum.reuse(
         size=file.size, mtime=file.mtime, path=realpath, dev=file.dev, ino=file.ino
     )
+    return realpath, existing
+
+
+def digest(realpath: str) -> str | None:
+    try:
+        with open(realpath, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except Exception as e:
+        log.error(f"Error check {realpath}: {e}")
+        return None
+
+
+def fingerprint(realpath: str, size: int) -> str | None:
+    """
+    计算快速指纹，指纹不同的文件一定不同，指纹相同时需要比较完整的校验和
+
+    小文件返回 None
+    """
+    if size < QUICK_MIN_SIZE:
+        return None
+    try:
+        sha = hashlib.sha256(str(size).encode())
+        with open(realpath, "rb") as f:
+            for i in range(QUICK_BLOCKS):
+                f.seek((size - QUICK_BLOCK_SIZE) * i // (QUICK_BLOCKS - 1))
+                sha.update(f.read(QUICK_BLOCK_SIZE))
+        return sha.hexdigest()
+    except Exception as e:
+        log.error(f"Error fingerprint {realpath}: {e}")
+        return None
+
+
+def digest_both(realpath: str, size: int) -> tuple[str | None, str | None]:
+    """计算 (校验和, 快速指纹)"""
+    checksum = digest(realpath)
+    if checksum is None:
+        return None, None
+    return checksum, fingerprint(realpath, size)
+
+
+def stored_fingerprint(row: Checksum) -> str | None:
+    """
+    校验和记录中的快速指纹，旧记录没有时，如果文件没有变化就补上
+    """
+    if row.quick is not None or row.size < QUICK_MIN_SIZE:
+        return row.quick
+    try:
+        st = os.stat(row.path)
+    except OSError:
+        return None
+    if st.st_size != row.size or st.st_mtime != row.mtime:
+        return None
+    quick = fingerprint(row.path, row.size)
+    if quick is not None:
+        row.quick = quick
+        row.self_update_quick()
+    return quick
+
+
+def may_duplicate(file: "tagfile.ListFile|File", include_notag: bool) -> bool:
+    """
+    用快速指纹判断文件是否可能和文件表中同样大小、已有校验和的文件相同
+
+    不能确定时（小文件、已有文件的指纹未知）返回 True，需要计算完整的校验和
+    """
+    realpath = tagfile.source_translate(file.path + file.name)
+    quick = fingerprint(realpath, file.size)
+    if quick is None:
+        return True
+    unknown = File.reuse_list_size_checksum(file.size, include_notag)
+    for row in Checksum.reuse_list_size(file.size):
+        if row.checksum not in unknown:
+            continue
+        stored = stored_fingerprint(row)
+        if stored == quick:
+            return True
+        if stored is not None:
+            unknown.discard(row.checksum)
+    return len(unknown) > 0
+
+
+def check(file: "tagfile.ListFile|File", cache_only: bool = False) -> str | None:
+    if file.is_dir:
+        return None
+    realpath, existing = lookup(file)
     if existing is not None:
         existing.self_update_lasttime()
         return existing.checksum
-    else:
-        if cache_only:
-            return None
+    if cache_only:
+        return None
+    checksum, quick = digest_both(realpath, file.size)
+    if checksum is not None:
+        Checksum.add(
+            path=realpath,
+            size=file.size,
+            mtime=file.mtime,
+            dev=file.dev,
+            ino=file.ino,
+            checksum=checksum,
+            quick=quick,
+        )
+    return checksum
+
+
+def check_many(files: Iterable[F], workers: int = 4) -> Iterator[tuple[F, str | None]]:
+    """
+    并行计算校验和，按完成顺序返回 (文件, 校验和)
+
+    同时最多有 workers 个文件在计算。数据库只在调用方线程访问，
+    在 db.batch() 中调用时新的校验和会批量写入。
+    """
+    workers = max(1, workers)
+    pending: dict[Future[tuple[str | None, str | None]], tuple[F, str]] = {}
+    it = iter(files)
+    exhausted = False
+    with ThreadPoolExecutor(workers, "checksum") as pool:
         try:
-            with open(realpath, "rb") as f:
-                digest = hashlib.file_digest(f, "sha256")
-            Checksum.add(
-                path=realpath,
-                size=file.size,
-                mtime=file.mtime,
-                dev=file.dev,
-                ino=file.ino,
-                checksum=digest.hexdigest(),
-            )
-            return digest.hexdigest()
-        except Exception as e:
-            log.error(f"Error check {realpath}: {e}")
-            return None
+            while True:
+                while not exhausted and len(pending) < workers:
+                    file = next(it, None)
+                    if file is None:
+                        exhausted = True
+                        break
+                    if file.is_dir:
+                        yield file, None
+                        continue
+                    realpath, existing = lookup(file)
+                    if existing is not None:
+                        existing.self_update_lasttime()
+                        yield file, existing.checksum
+                        continue
+                    pending[pool.submit(digest_both, realpath, file.size)] = (
+                        file,
+                        realpath,
+                    )
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file, realpath = pending.pop(future)
+                    checksum, quick = future.result()
+                    if checksum is not None:
+                        Checksum.add(
+                            path=realpath,
+                            size=file.size,
+                            mtime=file.mtime,
+                            dev=file.dev,
+                            ino=file.ino,
+                            checksum=checksum,
+                            quick=quick,
+                        )
+                    yield file, checksum
+        finally:
+            for future in pending:
+                future.cancel()
@@ -1,11 +1,32 @@
 """
 CLI package for atagspace.
 Contains all command-line interface components organized by functionality.
+Command groups are imported on first access, so running one group does not
+import the others.
 """
 
-from .db import db_cli
-from .tagfile import tagfile_cli
-from .category import category_cli
-from .extension import extension_cli
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .category import category_cli
+    from .db import db_cli
+    from .extension import extension_cli
+    from .tagfile import tagfile_cli
+
+_modules = {
+    "db_cli": "db",
+    "tagfile_cli": "tagfile",
+    "category_cli": "category",
+    "extension_cli": "extension",
+}
+
+
+def __getattr__(name: str):
+    if name in _modules:
+        module = importlib.import_module(f".{_modules[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["db_cli", "tagfile_cli", "category_cli", "extension_cli"]
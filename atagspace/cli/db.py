@@ -6,7 +6,6 @@ import typer
 import time
 
 from .. import db
-from ..extensions import singlefilerename
 
 db_cli = typer.Typer(help="数据库管理")
 
@@ -14,7 +13,10 @@ db_cli = typer.Typer(help="数据库管理")
 @db_cli.command("init")
 def db_init():
     """初始化数据库"""
-    # the db is initialized whether command run
+    from ..extensions import singlefilerename
+
+    # 启动时只在表结构版本变化时检查，这里总是完整检查一次
+    db.init(force=True)
     singlefilerename.init()
     typer.echo("数据库初始化完成")
 
@@ -22,6 +24,8 @@ def db_init():
 @db_cli.command("clean")
 def db_clean(cdays: float = typer.Argument(..., help="过期时间(天)")):
     """清理数据库"""
+    from ..extensions import singlefilerename
+
     expire_time = time.time() - cdays * 24 * 60 * 60
     db.purge_deleted(expire_time)
     singlefilerename.purge_deleted(expire_time)
@@ -1,10 +1,12 @@
 """
 Extension commands for atagspace CLI.
+Extension modules are imported inside each command, some of them pull in
+slow imports (aiohttp, dateparser).
 """
 
-import typer
+from typing import Optional
 
-from ..extensions import totag, sorttag, tagspaces, automove, unempty
+import typer
 
 extension_cli = typer.Typer(help="扩展命令")
 
@@ -19,6 +21,8 @@ def extension_totag(
     send_number: bool = typer.Option(False, "-s", "--send-number", help="发送数量"),
 ):
     """同步待分类标记"""
+    from ..extensions import totag
+
     todo_count, finish_count, toread_count = totag.totag(
         path, markall, clear_file_tags, send_number
     )
@@ -30,6 +34,8 @@ def extension_totag(
 @extension_cli.command("sorttag")
 def extension_sorttag(path: str = typer.Argument("", help="路径")):
     """排序标记"""
+    from ..extensions import sorttag
+
     sort_count = sorttag.sorttag(path)
     typer.echo(f"排序完成 {sort_count} 个文件")
 
@@ -42,10 +48,54 @@ def extension_automove(
     mark_missed: bool = typer.Option(
         False, "-M", "--mark-missed", help="标记未匹配文件"
     ),
+    stats: bool = typer.Option(False, "--stats", help="输出每条规则的测试次数和耗时"),
+    rename_workers: int = typer.Option(
+        8, "--rename-workers", help="同一设备内移动的线程数"
+    ),
+    copy_workers: int = typer.Option(
+        2, "--copy-workers", help="每对设备之间跨设备复制的线程数"
+    ),
+    plan: Optional[str] = typer.Option(
+        None, "-p", "--plan", help="不移动文件，把移动计划写入这个文件"
+    ),
 ):
     """根据规则移动文件"""
-    moved_count = automove.automove(path, moverule, dry_run, mark_missed)
-    typer.echo(f"移动完成 {moved_count} 个文件")
+    from ..extensions import automove
+
+    rule_stats = automove.RuleStats() if stats else None
+    moved_count = automove.automove(
+        path,
+        moverule,
+        dry_run,
+        mark_missed,
+        rule_stats,
+        rename_workers=rename_workers,
+        copy_workers=copy_workers,
+        plan=plan,
+    )
+    if plan is not None:
+        typer.echo(f"计划移动 {moved_count} 个文件")
+    else:
+        typer.echo(f"移动完成 {moved_count} 个文件")
+    if rule_stats is not None:
+        typer.echo(rule_stats.report())
+
+
+@extension_cli.command("automove_apply")
+def extension_automove_apply(
+    plan: str = typer.Argument(..., help="automove --plan 生成的移动计划"),
+    rename_workers: int = typer.Option(
+        8, "--rename-workers", help="同一设备内移动的线程数"
+    ),
+    copy_workers: int = typer.Option(
+        2, "--copy-workers", help="每对设备之间跨设备复制的线程数"
+    ),
+):
+    """执行移动计划"""
+    from ..extensions import automove
+
+    moved_count, stale_count = automove.apply_plan(plan, rename_workers, copy_workers)
+    typer.echo(f"移动完成 {moved_count} 个文件，跳过 {stale_count} 个已变化的文件")
 
 
 @extension_cli.command("unempty")
@@ -54,6 +104,8 @@ def extension_unempty(
     dry_run: bool = typer.Option(False, "-d", "--dry-run", help="模拟运行"),
 ):
     """删除空目录"""
+    from ..extensions import unempty
+
     finish_count = unempty.unempty(path, dry_run)
     typer.echo(f"删除完成 {finish_count} 个空目录")
 
@@ -61,6 +113,8 @@ def extension_unempty(
 @extension_cli.command("tagspaces")
 def extension_tagspaces(path: str = typer.Argument("", help="路径")):
     """从 tagspaces 导入标记"""
+    from ..extensions import tagspaces
+
     import_count = tagspaces.tagspaces_import(path)
     typer.echo(f"导入完成 {import_count} 个文件")
 
@@ -74,6 +128,8 @@ def extension_tagspaces_export(
     ),
 ):
     """从 tagspaces 导出标记"""
+    from ..extensions import tagspaces
+
     export_count = tagspaces.tagspaces_export(path, dry_run, singlefile)
     typer.echo(f"导出完成 {export_count} 个文件")
 
@@ -81,6 +137,8 @@ def extension_tagspaces_export(
 @extension_cli.command("tagspaces_library")
 def extension_tagspaces_library(path: str = typer.Argument("", help="路径")):
     """从 tagspaces 导入标记"""
+    from ..extensions import tagspaces
+
     import_count = tagspaces.tagspaces_category_import(path)
     typer.echo("导入完成")
 
@@ -88,5 +146,7 @@ def extension_tagspaces_library(path: str = typer.Argument("", help="路径")):
 @extension_cli.command("tagspaces_export_library")
 def extension_tagspaces_export_library(path: str = typer.Argument("", help="路径")):
     """从 tagspaces 导出标记"""
+    from ..extensions import tagspaces
+
     export_count = tagspaces.tagspaces_category_export(path)
     typer.echo("导出完成")
@@ -17,9 +17,12 @@ def tagfile_listfile(
     recurse: bool = typer.Option(False, "-r", "--recurse", help="递归搜索"),
     color: bool = typer.Option(False, "-c", "--color", help="彩色输出"),
     limits: int = typer.Option(1000, "-l", "--limits", help="限制数量"),
+    after: str = typer.Option("", "-a", "--after", help="从该路径之后开始列出(分页)"),
 ):
     """列出文件"""
-    ret = tagfile.list_file(path, tagfile.arglist(filter_str), recurse, limits)
+    ret = tagfile.list_file(
+        path, tagfile.arglist(filter_str), recurse, limits, after or None
+    )
     for file in ret:
         typer.echo(
             str(file.id) + " " + file.path + file.name + ("/" if file.is_dir else "")
@@ -29,12 +32,55 @@ def tagfile_listfile(
         )
 
 
+@tagfile_cli.command("facets")
+def tagfile_facets(
+    path: str = typer.Argument("", help="路径"),
+    filter_str: str = typer.Option("", "-f", "--filter", help="过滤条件"),
+    recurse: bool = typer.Option(False, "-r", "--recurse", help="递归搜索"),
+    color: bool = typer.Option(False, "-c", "--color", help="彩色输出"),
+):
+    """统计标签和分类"""
+    ret = tagfile.facets(path, tagfile.arglist(filter_str), recurse)
+    typer.echo(f"{ret['count']} 个文件 {ret['size']} 字节")
+    for name, item in sorted(ret["categories"].items()):
+        typer.echo(f"~{name} {item['count']} {item['size']}")
+    for name, item in sorted(ret["tags"].items()):
+        typer.echo(f"{tagfmt(name, color)} {item['count']} {item['size']}")
+
+
 @tagfile_cli.command("updatenew")
 def tagfile_updatenew(
-    full: bool = typer.Option(False, "-f", "--full", help="完全刷新")
+    full: bool = typer.Option(False, "-f", "--full", help="完全刷新"),
+    scan_workers: int = typer.Option(4, "--scan-workers", help="每个设备的扫描线程数"),
+    hash_workers: int = typer.Option(4, "--hash-workers", help="校验线程数"),
+    incremental: bool = typer.Option(
+        False,
+        "-i",
+        "--incremental",
+        help="增量刷新，跳过没有修改的目录（发现不了直接修改的文件内容，需要定期完整刷新）",
+    ),
 ):
     """刷新文件"""
-    tagfile.update_new(full=full)
+    tagfile.update_new(
+        full=full,
+        scan_workers=scan_workers,
+        hash_workers=hash_workers,
+        incremental=incremental,
+    )
+
+
+@tagfile_cli.command("watch")
+def tagfile_watch(
+    debounce: int = typer.Option(1600, "--debounce", help="合并事件的等待时间(毫秒)"),
+    scan_workers: int = typer.Option(4, "--scan-workers", help="每个设备的扫描线程数"),
+    hash_workers: int = typer.Option(4, "--hash-workers", help="校验线程数"),
+):
+    """监视文件变化，持续刷新文件"""
+    from .. import watcher
+
+    watcher.watch(
+        debounce=debounce, scan_workers=scan_workers, hash_workers=hash_workers
+    )
 
 
 @tagfile_cli.command("updatesrc")
@@ -8,15 +8,14 @@ This module provides a clean, organized CLI structure that addresses the origina
 
 import typer
 import logging
+import sys
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 from . import db
-from .cli import db_cli, tagfile_cli, category_cli, extension_cli
-from .web import app
-from aiohttp import web as aiohttp_web
+from . import cli
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -25,6 +24,14 @@ log = logging.getLogger(__name__)
 app_cli = typer.Typer(help="atagspace - 文件标签管理系统")
 
 
+@app_cli.callback()
+def app_callback(
+    db_path: str = typer.Option(db.DB_PATH, "--db", help="数据库文件"),
+):
+    db.DB_PATH = db_path
+    db.init()
+
+
 # Web command
 @app_cli.command()
 def web(
@@ -32,20 +39,44 @@ def web(
     port: int = typer.Option(4590, help="端口"),
 ):
     """启动WebUI"""
+    from aiohttp import web as aiohttp_web
+    from .web import app
+
     aiohttp_web.run_app(app, host=host, port=port)
 
 
-# Add command groups
-app_cli.add_typer(db_cli, name="db")
-app_cli.add_typer(tagfile_cli, name="tagfile")
-app_cli.add_typer(category_cli, name="category")
-app_cli.add_typer(extension_cli, name="extension")
+# Command groups, imported on demand
+command_groups = {
+    "db": "db_cli",
+    "tagfile": "tagfile_cli",
+    "category": "category_cli",
+    "extension": "extension_cli",
+}
+
+
+def add_command_groups(args: list[str]) -> None:
+    """
+    只添加要执行的命令组，其他命令组不导入；没有指定命令组时（例如 --help）全部添加
+    """
+    command = None
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == "--db":
+            skip = True
+        elif not arg.startswith("-"):
+            command = arg
+            break
+    names = [command] if command in command_groups else list(command_groups)
+    for name in names:
+        app_cli.add_typer(getattr(cli, command_groups[name]), name=name)
 
 
 def run():
     """Main entry point"""
     try:
-        db.init()
+        add_command_groups(sys.argv[1:])
         app_cli()
     finally:
         db.close()
@@ -1,15 +1,158 @@
 import sqlite3
 import glob
+import json
+import os
 import time
+import re
+import threading
+import urllib.parse
+from contextlib import contextmanager
 from dataclasses import dataclass
+from typing import Any, Iterator
 
 from .constants import DEFAULT_COLOR
 
-sqlite_db = sqlite3.connect("atagspace.db")
-sqlite_db.execute("PRAGMA auto_vacuum = FULL;")
-sqlite_db.execute("PRAGMA foreign_keys = ON;")
-sqlite_db.execute("PRAGMA journal_mode = WAL;")
-sqlite_db.execute("PRAGMA synchronous = NORMAL;")
+# 可以用环境变量 ATAGSPACE_DB 或命令行的 --db 指定，在第一次使用连接前修改有效
+DB_PATH = os.environ.get("ATAGSPACE_DB", "atagspace.db")
+# 表结构有变化时增加，数据库中记录的版本（user_version）较低时才重新检查表结构
+SCHEMA_VERSION = 4
+
+
+def _glob_match(pattern: str, value: str) -> bool:
+    return re.match(pattern, value, re.IGNORECASE) is not None
+
+
+def connect(
+    readonly: bool = False, check_same_thread: bool = True
+) -> sqlite3.Connection:
+    """
+    打开一个数据库连接，readonly 时以只读方式打开（用于并发读取）
+
+    check_same_thread 为 False 时允许在其他线程关闭连接（例如线程池结束后统一关闭）
+    """
+    if readonly:
+        uri = "file:" + urllib.parse.quote(DB_PATH) + "?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        connection = sqlite3.connect(DB_PATH, check_same_thread=check_same_thread)
+        connection.execute("PRAGMA auto_vacuum = FULL;")
+        connection.execute("PRAGMA journal_mode = WAL;")
+    connection.execute("PRAGMA foreign_keys = ON;")
+    connection.execute("PRAGMA synchronous = NORMAL;")
+    # 用于 sqlfilter 生成的条件，和 tagfile.Filter 的匹配规则一致
+    connection.create_function("glob_match", 2, _glob_match, deterministic=True)
+    connection.create_function("py_lower", 1, str.lower, deterministic=True)
+    return connection
+
+
+class _Local(threading.local):
+    """每个线程各自的连接、批量写入、标签索引和待更新使用时间的校验和"""
+
+    connection: sqlite3.Connection | None = None
+    batch: "Batch | None" = None
+    tag_index: "TagIndex | None" = None
+    checksum_touched: "set[int] | None" = None
+
+
+_local = _Local()
+# 主连接在第一次使用时才打开
+_main_connection: sqlite3.Connection | None = None
+_main_lock = threading.Lock()
+
+
+def _main() -> sqlite3.Connection:
+    global _main_connection
+    if _main_connection is None:
+        with _main_lock:
+            if _main_connection is None:
+                _main_connection = connect()
+    return _main_connection
+
+
+def bind(connection: sqlite3.Connection) -> None:
+    """
+    让当前线程使用指定的连接（例如 web 的读写线程池），未绑定的线程使用主连接
+    """
+    _local.connection = connection
+
+
+class _Connection:
+    """当前线程使用的数据库连接"""
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(_local.connection or _main(), name)
+
+
+sqlite_db: sqlite3.Connection = _Connection()  # type: ignore
+
+
+# batch
+
+
+class Batch:
+    """
+    批量写入
+
+    写操作先暂存，连续的相同语句用 executemany 一起执行，
+    每暂存 size 条提交一次事务。
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.pending: list[tuple[str, list[tuple[Any, ...]]]] = []
+        self.count = 0
+
+    def execute(self, sql: str, params: tuple[Any, ...]) -> None:
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].append(params)
+        else:
+            self.pending.append((sql, [params]))
+        self.count += 1
+        if self.count >= self.size:
+            self.commit()
+
+    def flush(self) -> None:
+        """执行暂存的写操作，但不提交"""
+        for sql, rows in self.pending:
+            sqlite_db.executemany(sql, rows)
+        self.pending.clear()
+
+    def commit(self) -> None:
+        self.flush()
+        sqlite_db.commit()
+        self.count = 0
+
+
+@contextmanager
+def batch(size: int = 10000) -> Iterator[Batch]:
+    """
+    在此范围内，File 和 Checksum 的写操作暂存到同一个 Batch 中，
+    读操作前会先执行暂存的写操作。嵌套时使用外层的 Batch。
+    """
+    if _local.batch is not None:
+        yield _local.batch
+        return
+    current = _local.batch = Batch(size)
+    try:
+        yield current
+        Checksum.flush_lasttime()
+    finally:
+        _local.batch = None
+        current.commit()
+
+
+def _write(sql: str, params: tuple[Any, ...]) -> None:
+    if _local.batch is not None:
+        _local.batch.execute(sql, params)
+    else:
+        sqlite_db.execute(sql, params)
+        sqlite_db.commit()
+
+
+def _execute(sql: str, params: tuple[Any, ...] = ()) -> sqlite3.Cursor:
+    if _local.batch is not None:
+        _local.batch.flush()
+    return sqlite_db.execute(sql, params)
 
 
 # tagfile
@@ -93,70 +236,180 @@ class File:
 
     @staticmethod
     def set_tags(id_: int, tags: str) -> None:
-        sqlite_db.execute("UPDATE file SET tags = ? WHERE id = ?", (tags, id_))
-        sqlite_db.commit()
+        _write("UPDATE file SET tags = ? WHERE id = ?", (tags, id_))
+
+    @staticmethod
+    def set_tags_many(rows: "list[tuple[str, int]]") -> None:
+        """
+        在一个事务中设置多个文件的标签，rows 为 (标签, id)，用 executemany 执行
+
+        在 batch() 中调用时先执行暂存的写操作，由 batch() 提交。
+        """
+        if not rows:
+            return
+        sql = "UPDATE file SET tags = ? WHERE id = ?"
+        if _local.batch is not None:
+            _local.batch.flush()
+            sqlite_db.executemany(sql, rows)
+        else:
+            sqlite_db.executemany(sql, rows)
+            sqlite_db.commit()
 
     @staticmethod
     def get_tags(id_: int) -> str:
-        return sqlite_db.execute(
-            "SELECT tags FROM file WHERE id = ?", (id_,)
-        ).fetchone()[0]
+        return _execute("SELECT tags FROM file WHERE id = ?", (id_,)).fetchone()[0]
+
+    @staticmethod
+    def list(
+        path: str,
+        where: str = "1",
+        params: "list[Any] | None" = None,
+        after: str | None = None,
+    ) -> list["File"]:
+        return list(File.iter(path, where, params, after))
 
     @staticmethod
-    def list(path: str) -> list["File"]:
+    def iter(
+        path: str,
+        where: str = "1",
+        params: "list[Any] | None" = None,
+        after: str | None = None,
+    ) -> "Iterator[File]":
         if path[-1] != "/":
             path += "/"
-        return [
-            File(*row)
-            for row in sqlite_db.execute(
-                "SELECT * FROM file WHERE path = ? AND deltime IS NULL ORDER BY name",
-                (path,),
-            )
-        ]
+        if after is not None:
+            # 分页：从名称在 after 之后的文件开始
+            where = f"name > ? AND ({where})"
+            params = [after, *(params or [])]
+        for row in _execute(
+            "SELECT * FROM file WHERE path = ? AND deltime IS NULL"
+            f" AND ({where}) ORDER BY name",
+            (path, *(params or [])),
+        ):
+            yield File(*row)
 
     @staticmethod
-    def list_recurse(path: str) -> "list[File]":
+    def iter_recurse(
+        path: str,
+        where: str = "1",
+        params: "list[Any] | None" = None,
+        limit: int = -1,
+        after: tuple[str, str] | None = None,
+    ) -> "Iterator[File]":
+        """
+        按 (path, name) 顺序逐条返回子目录中的文件
+
+        after 为上一页最后一个文件的 (path, name)，查询直接从索引中这个位置之后开始，
+        每一页的代价相同。
+        """
         if path[-1] == "/":
             path = path[:-1]
-        if path == "/":
-            # oh, no!
-            return [
-                File(*row)
-                for row in sqlite_db.execute(
-                    "SELECT * FROM file WHERE deltime IS NULL ORDER BY path, name", ()
-                )
-            ]
+        # 根目录时 path 为 ""，范围是整个表 (oh, no!)
         slash = "/"
         slash_plus_1 = chr(ord(slash) + 1)
+        if after is not None and after >= (path + slash, ""):
+            lower, lower_params = "(path, name) > (?, ?)", [*after]
+        else:
+            lower, lower_params = "path >= ?", [path + slash]
+        for row in _execute(
+            f"SELECT * FROM file WHERE {lower} AND path < ? AND deltime IS NULL"
+            f" AND ({where}) ORDER BY path, name LIMIT ?",
+            (*lower_params, path + slash_plus_1, *(params or []), limit),
+        ):
+            yield File(*row)
+
+    @staticmethod
+    def list_recurse(
+        path: str,
+        where: str = "1",
+        params: "list[Any] | None" = None,
+        limit: int = -1,
+        after: tuple[str, str] | None = None,
+    ) -> "list[File]":
+        return list(File.iter_recurse(path, where, params, limit, after))
+
+    @staticmethod
+    def facets(
+        path: str,
+        recurse: bool,
+        where: str = "1",
+        params: "list[Any] | None" = None,
+    ) -> "list[tuple[int, str | None, int, int]]":
+        """
+        统计目录中（recurse 时包括子目录）符合条件的文件，返回 (类型, 名称, 文件数, 大小)
+
+        类型 0 为全部文件（名称为 None），1 为每个标签，2 为每个分类（有该分类中标签的文件），
+        目录的大小不计入。
+        """
+        if recurse:
+            if path[-1] == "/":
+                path = path[:-1]
+            scope, scope_params = "path >= ? AND path < ?", [
+                path + "/",
+                path + chr(ord("/") + 1),
+            ]
+        else:
+            if path[-1] != "/":
+                path += "/"
+            scope, scope_params = "path = ?", [path]
+        return _execute(
+            "WITH selected AS MATERIALIZED ("
+            " SELECT id, CASE WHEN is_dir THEN 0 ELSE size END AS size FROM file"
+            f" WHERE {scope} AND deltime IS NULL AND ({where})),"
+            " tagged AS ("
+            " SELECT selected.id, selected.size, file_tag.tag FROM selected"
+            " JOIN file_tag ON file_tag.file_id = selected.id)"
+            " SELECT 0, NULL, count(*), coalesce(sum(size), 0) FROM selected"
+            " UNION ALL"
+            " SELECT 1, tag, count(*), sum(size) FROM tagged GROUP BY tag"
+            " UNION ALL"
+            " SELECT 2, cate, count(*), sum(size) FROM ("
+            " SELECT DISTINCT tagged.id, tagged.size, category.name AS cate"
+            " FROM tagged JOIN tag ON tag.name = tagged.tag"
+            " JOIN category ON category.id = tag.cate_id)"
+            " GROUP BY cate",
+            (*scope_params, *(params or [])),
+        ).fetchall()
+
+    @staticmethod
+    def list_id(ids: "list[int]") -> "list[File]":
+        """列出 id 在 ids 中且没有删除的文件，顺序不确定"""
         return [
             File(*row)
-            for row in sqlite_db.execute(
-                "SELECT * FROM file WHERE path >= ? AND path < ? AND deltime IS NULL ORDER BY path, name",
-                (path + slash, path + slash_plus_1),
+            for row in _execute(
+                "SELECT * FROM file WHERE id IN (SELECT value FROM json_each(?))"
+                " AND deltime IS NULL",
+                (json.dumps(ids),),
             )
         ]
 
     @staticmethod
-    def mark_all_delete() -> None:
-        sqlite_db.execute(
-            "UPDATE file SET deltime = ? WHERE deltime IS NULL", (time.time(),)
-        )
-        sqlite_db.commit()
+    def list_all() -> "list[File]":
+        return [File(*row) for row in _execute("SELECT * FROM file ORDER BY id")]
+
+    @staticmethod
+    def list_dirs() -> "list[tuple[str, str, float]]":
+        return _execute(
+            "SELECT path, name, mtime FROM file WHERE is_dir AND deltime IS NULL"
+        ).fetchall()
+
+    @staticmethod
+    def set_deltime(id_: int, deltime: float | None) -> None:
+        _write("UPDATE file SET deltime = ? WHERE id = ?", (deltime, id_))
 
     @staticmethod
     def mark_delete(path: str, name: str) -> None:
-        sqlite_db.execute(
+        _write(
             "UPDATE file SET deltime = ? WHERE path = ? AND name = ? AND deltime IS NULL",
             (time.time(), path, name),
         )
         path_name = path + name
         path_lower_bound = path_name + "/"
         path_upper_bound = path_name + chr(ord("/") + 1)
-        sqlite_db.execute(
+        _write(
             "UPDATE file SET deltime = ? WHERE path >= ? AND path < ? AND deltime IS NULL",
             (time.time(), path_lower_bound, path_upper_bound),
         )
-        sqlite_db.commit()
 
     @staticmethod
     def add(
@@ -170,14 +423,13 @@ class File:
         is_dir: bool,
         tags: str,
     ) -> None:
-        sqlite_db.execute(
+        _write(
             "INSERT INTO file (path, name, size, mtime, dev, ino, checksum, is_dir, tags, deltime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (path, name, size, mtime, dev, ino, checksum, is_dir, tags, None),
         )
-        sqlite_db.commit()
 
     def self_update(self) -> None:
-        sqlite_db.execute(
+        _write(
             "UPDATE file SET"
             " path = ?, name = ?, size = ?, mtime = ?, dev = ?, ino = ?, checksum = ?, is_dir = ?, tags = ?, deltime = ?"
             " WHERE id = ?",
@@ -195,18 +447,17 @@ class File:
                 self.id,
             ),
         )
-        sqlite_db.commit()
 
     @staticmethod
     def exists(path: str, name: str) -> bool:
-        row = sqlite_db.execute(
+        row = _execute(
             "SELECT 1 FROM file WHERE path = ? AND name = ?", (path, name)
         ).fetchone()
         return row is not None
 
     @staticmethod
     def reuse_get_path_name(path: str, name: str) -> "File | None":
-        row = sqlite_db.execute(
+        row = _execute(
             "SELECT * FROM file WHERE path = ? AND name = ?", (path, name)
         ).fetchone()
         return File(*row) if row is not None else None
@@ -215,7 +466,7 @@ class File:
     def reuse_get_dev_ino(dev: int, ino: int) -> "File | None":
         if ino == 0 or dev == 0:
             return None
-        row = sqlite_db.execute(
+        row = _execute(
             "SELECT * FROM file WHERE dev = ? AND ino = ?", (dev, ino)
         ).fetchone()
         return File(*row) if row is not None else None
@@ -224,26 +475,48 @@ class File:
     def reuse_list_size(size: int, include_notag: bool) -> "list[File]":
         return [
             File(*row)
-            for row in sqlite_db.execute(
+            for row in _execute(
                 "SELECT * FROM file WHERE size = ?"
                 + (" AND tags != ''" if not include_notag else ""),
                 (size,),
             )
         ]
 
+    @staticmethod
+    def reuse_has_size(size: int, include_notag: bool) -> bool:
+        row = _execute(
+            "SELECT 1 FROM file WHERE size = ?"
+            + (" AND tags != ''" if not include_notag else "")
+            + " LIMIT 1",
+            (size,),
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def reuse_list_size_checksum(size: int, include_notag: bool) -> set[str]:
+        return {
+            row[0]
+            for row in _execute(
+                "SELECT DISTINCT checksum FROM file"
+                " WHERE size = ? AND checksum IS NOT NULL"
+                + (" AND tags != ''" if not include_notag else ""),
+                (size,),
+            )
+        }
+
     @staticmethod
     def reuse_get_size_checksum(size: int, checksum: str) -> "File|None":
-        row = sqlite_db.execute(
+        row = _execute(
             "SELECT * FROM file WHERE size = ? AND checksum = ?", (size, checksum)
         ).fetchone()
         return File(*row) if row is not None else None
 
     @staticmethod
     def set_path_name(id_: int, new_path: str | None, new_name: str | None) -> None:
-        with sqlite_db:
+        with batch():
             old_path: str
             old_name: str
-            old_path, old_name = sqlite_db.execute(
+            old_path, old_name = _execute(
                 "SELECT path, name FROM file WHERE id = ?", (id_,)
             ).fetchone()
             if new_path is None:
@@ -252,13 +525,13 @@ class File:
                 new_name = old_name
             new_path_name = new_path + new_name
             old_path_name = old_path + old_name
-            sqlite_db.execute(
+            _write(
                 "UPDATE file SET name = ?, path = ? WHERE id = ?",
                 (new_name, new_path, id_),
             )
             old_path_lower_bound = old_path_name + "/"
             old_path_upper_bound = old_path_name + chr(ord("/") + 1)
-            sqlite_db.execute(
+            _write(
                 "UPDATE file SET path = concat(?, SUBSTR(path, ? + 1)) WHERE path >= ? AND path < ?",
                 (
                     new_path_name + "/",
@@ -267,17 +540,146 @@ class File:
                     old_path_upper_bound,
                 ),
             )
-        sqlite_db.commit()
 
     @staticmethod
     def purge_deleted(time: float) -> None:
+        _execute("DELETE FROM file WHERE deltime IS NOT NULL AND deltime < ?", (time,))
+        sqlite_db.commit()
+
+
+# file_tag
+def _split_tags(rows: str) -> str:
+    """
+    把 rows（查询 (file_id, tags) 的 SELECT）中以空格分隔的标签拆分为
+    (file_id, value) 的子查询，用于触发器和填充 file_tag
+
+    用 instr/substr 逐个拆分，标签中可以包含任意字符（包括控制字符）。
+    """
+    return (
+        "(WITH RECURSIVE split(file_id, value, rest) AS ("
+        f" SELECT file_id, '', tags || ' ' FROM ({rows})"
+        " UNION ALL SELECT file_id,"
+        " substr(rest, 1, instr(rest, ' ') - 1), substr(rest, instr(rest, ' ') + 1)"
+        " FROM split WHERE rest != '')"
+        " SELECT file_id, value FROM split WHERE value != '')"
+    )
+
+
+class FileTag:
+    """
+    文件和标签的对应关系，由触发器根据 file.tags 维护
+
+    标签不一定在 tag 表中，所以直接记录标签名。
+    """
+
+    @staticmethod
+    def init() -> None:
+        exists = sqlite_db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_tag'"
+        ).fetchone()
         sqlite_db.execute(
-            "DELETE FROM file WHERE deltime IS NOT NULL AND deltime < ?", (time,)
+            "CREATE TABLE IF NOT EXISTS file_tag ("
+            " file_id INTEGER,"
+            " tag TEXT,"
+            " PRIMARY KEY (file_id, tag)) WITHOUT ROWID"
         )
-        sqlite_db.commit()
+        sqlite_db.execute(
+            "CREATE INDEX IF NOT EXISTS file_tag_tag ON file_tag (tag, file_id)"
+        )
+        split_new = _split_tags("SELECT NEW.id AS file_id, NEW.tags AS tags")
+        triggers = {
+            "file_tag_insert": (
+                "CREATE TRIGGER file_tag_insert AFTER INSERT ON file BEGIN"
+                " INSERT OR IGNORE INTO file_tag (file_id, tag)"
+                f" SELECT file_id, value FROM {split_new};"
+                " END"
+            ),
+            "file_tag_update": (
+                "CREATE TRIGGER file_tag_update AFTER UPDATE OF tags ON file"
+                " WHEN OLD.tags IS NOT NEW.tags BEGIN"
+                " DELETE FROM file_tag WHERE file_id = OLD.id;"
+                " INSERT OR IGNORE INTO file_tag (file_id, tag)"
+                f" SELECT file_id, value FROM {split_new};"
+                " END"
+            ),
+            "file_tag_delete": (
+                "CREATE TRIGGER file_tag_delete AFTER DELETE ON file BEGIN"
+                " DELETE FROM file_tag WHERE file_id = OLD.id;"
+                " END"
+            ),
+        }
+        # 新建的表，或者触发器有变化（旧版本的拆分方法不同）时，从 file.tags 重新填充
+        refill = exists is None
+        for name, sql in triggers.items():
+            row = sqlite_db.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                (name,),
+            ).fetchone()
+            if row is not None and row[0] == sql:
+                continue
+            if row is not None:
+                sqlite_db.execute(f"DROP TRIGGER {name}")
+                refill = True
+            sqlite_db.execute(sql)
+        if refill:
+            sqlite_db.execute("DELETE FROM file_tag")
+            sqlite_db.execute(
+                "INSERT OR IGNORE INTO file_tag (file_id, tag) SELECT file_id, value"
+                f" FROM {_split_tags('SELECT id AS file_id, tags FROM file')}"
+            )
+
+
+# file_fts
+class FileFts:
+    """
+    文件名和完整路径（path || name）的 FTS5 trigram 索引，rowid 是 file.id，
+    由触发器根据 file 维护
+
+    trigram 只能查找至少 3 个字符的子串，不区分大小写。
+    """
+
+    @staticmethod
+    def init() -> None:
+        exists = sqlite_db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_fts'"
+        ).fetchone()
+        sqlite_db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS file_fts"
+            " USING fts5(name, fullpath, tokenize = 'trigram')"
+        )
+        sqlite_db.execute(
+            "CREATE TRIGGER IF NOT EXISTS file_fts_insert AFTER INSERT ON file BEGIN"
+            " INSERT INTO file_fts (rowid, name, fullpath)"
+            " VALUES (NEW.id, NEW.name, NEW.path || NEW.name);"
+            " END"
+        )
+        sqlite_db.execute(
+            "CREATE TRIGGER IF NOT EXISTS file_fts_update"
+            " AFTER UPDATE OF path, name ON file"
+            " WHEN OLD.path IS NOT NEW.path OR OLD.name IS NOT NEW.name BEGIN"
+            " UPDATE file_fts SET name = NEW.name, fullpath = NEW.path || NEW.name"
+            " WHERE rowid = OLD.id;"
+            " END"
+        )
+        sqlite_db.execute(
+            "CREATE TRIGGER IF NOT EXISTS file_fts_delete AFTER DELETE ON file BEGIN"
+            " DELETE FROM file_fts WHERE rowid = OLD.id;"
+            " END"
+        )
+        if exists is None:
+            # 新建的表，从已有的记录填充
+            sqlite_db.execute(
+                "INSERT INTO file_fts (rowid, name, fullpath)"
+                " SELECT id, name, path || name FROM file"
+            )
 
 
 # checksum
+
+# 记录的已使用校验和达到这个数量时更新一次最后使用时间
+CHECKSUM_TOUCH_SIZE = 10000
+
+
 @dataclass
 class Checksum:
     id: int
@@ -288,6 +690,7 @@ class Checksum:
     ino: int
     checksum: str
     lasttime: float
+    quick: str | None
 
     @staticmethod
     def init() -> None:
@@ -300,28 +703,38 @@ class Checksum:
             " dev INTEGER,"
             " ino INTEGER,"
             " checksum TEXT,"
-            " lasttime REAL)"
+            " lasttime REAL,"
+            " quick TEXT)"
         )
+        columns = [row[1] for row in sqlite_db.execute("PRAGMA table_info(checksum)")]
+        if "quick" not in columns:
+            sqlite_db.execute("ALTER TABLE checksum ADD COLUMN quick TEXT")
         sqlite_db.execute(
             "CREATE INDEX IF NOT EXISTS checksum_size_mtime ON checksum (size, mtime)"
         )
 
     @staticmethod
     def add(
-        path: str, size: int, mtime: float, dev: int, ino: int, checksum: str
+        path: str,
+        size: int,
+        mtime: float,
+        dev: int,
+        ino: int,
+        checksum: str,
+        quick: str | None = None,
     ) -> None:
-        sqlite_db.execute(
-            "INSERT INTO checksum (path, size, mtime, dev, ino, checksum, lasttime)"
-            " VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (path, size, mtime, dev, ino, checksum, time.time()),
+        _write(
+            "INSERT INTO checksum"
+            " (path, size, mtime, dev, ino, checksum, lasttime, quick)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, dev, ino, checksum, time.time(), quick),
         )
-        sqlite_db.commit()
 
     @staticmethod
     def reuse(
         size: int, mtime: float, path: str, dev: int, ino: int
     ) -> "Checksum | None":
-        row = sqlite_db.execute(
+        row = _execute(
             "SELECT * FROM checksum WHERE "
             " size = ? AND mtime = ? AND"
             " (path = ? OR (dev = ? AND ino = ? AND dev != 0 AND ino != 0))",
@@ -329,15 +742,44 @@ class Checksum:
         ).fetchone()
         return Checksum(*row) if row is not None else None
 
+    @staticmethod
+    def reuse_list_size(size: int) -> "list[Checksum]":
+        return [
+            Checksum(*row)
+            for row in _execute("SELECT * FROM checksum WHERE size = ?", (size,))
+        ]
+
+    def self_update_quick(self) -> None:
+        _write("UPDATE checksum SET quick = ? WHERE id = ?", (self.quick, self.id))
+
     def self_update_lasttime(self) -> None:
-        sqlite_db.execute(
-            "UPDATE checksum SET lasttime = ? WHERE id = ?", (time.time(), self.id)
+        """
+        记录校验和被使用，最后使用时间由 flush_lasttime 一次更新
+        """
+        touched = _local.checksum_touched
+        if touched is None:
+            touched = _local.checksum_touched = set()
+        touched.add(self.id)
+        if len(touched) >= CHECKSUM_TOUCH_SIZE:
+            Checksum.flush_lasttime()
+
+    @staticmethod
+    def flush_lasttime() -> None:
+        """更新 self_update_lasttime 记录的校验和的最后使用时间"""
+        touched = _local.checksum_touched
+        if not touched:
+            return
+        _local.checksum_touched = None
+        _write(
+            "UPDATE checksum SET lasttime = ?"
+            " WHERE id IN (SELECT value FROM json_each(?))",
+            (time.time(), json.dumps(sorted(touched))),
         )
-        sqlite_db.commit()
 
     @staticmethod
     def purge_deleted(time: float) -> None:
-        sqlite_db.execute("DELETE FROM checksum WHERE lasttime < ?", (time,))
+        Checksum.flush_lasttime()
+        _execute("DELETE FROM checksum WHERE lasttime < ?", (time,))
         sqlite_db.commit()
 
 
@@ -375,6 +817,7 @@ class Category:
             (name, color),
         )
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def rename(name: str, newname: str) -> None:
@@ -382,6 +825,7 @@ class Category:
             "UPDATE category SET name = ? WHERE name = ?", (newname, name)
         )
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def get_id(name: str) -> int:
@@ -395,6 +839,7 @@ class Category:
         sqlite_db.execute("DELETE FROM tag WHERE cate_id = ?", (cate_id,))
         sqlite_db.execute("DELETE FROM category WHERE id = ?", (cate_id,))
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def get_color_id(id: int) -> str:
@@ -453,16 +898,19 @@ class Tag:
             (name, cate_id),
         )
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def set_color(name: str, color: str | None) -> None:
         sqlite_db.execute("UPDATE tag SET color = ? WHERE name = ?", (color, name))
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def remove(name: str) -> None:
         sqlite_db.execute("DELETE FROM tag WHERE name = ?", (name,))
         sqlite_db.commit()
+        TagIndex.invalidate()
 
     @staticmethod
     def get_category_name(name: str) -> str | None:
@@ -487,9 +935,87 @@ class Tag:
         return Category.get_color_id(cate_id)
 
 
-def init() -> None:
+class TagIndex:
+    """
+    标签元数据的内存索引：分类、标签、标签所属的分类和颜色
+
+    一次查询载入，每个线程（连接）各自缓存。本连接修改分类和标签时失效，
+    其他连接提交后通过 PRAGMA data_version 发现变化。频繁查询时应持有 get()
+    返回的对象。
+    """
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.categories: list[Category] = []
+        self.category_tags: dict[str, list[Tag]] = {}
+        self.tag_category: dict[str, str] = {}
+        self.tag_color: dict[str, str] = {}
+        self.default_color = DEFAULT_COLOR
+        category_color: dict[int, str] = {}
+        for (
+            cate_id,
+            cate_name,
+            cate_color,
+            tag_id,
+            tag_name,
+            tag_color,
+        ) in sqlite_db.execute(
+            "SELECT c.id, c.name, c.color, t.id, t.name, t.color"
+            " FROM category AS c LEFT JOIN tag AS t ON t.cate_id = c.id"
+            " ORDER BY c.name, t.name"
+        ):
+            if cate_name not in self.category_tags:
+                self.categories.append(Category(cate_id, cate_name, cate_color))
+                self.category_tags[cate_name] = []
+                category_color[cate_id] = (
+                    cate_color if cate_color is not None else DEFAULT_COLOR
+                )
+                if cate_name == "":
+                    self.default_color = category_color[cate_id]
+            if tag_id is None:
+                continue
+            self.category_tags[cate_name].append(
+                Tag(tag_id, cate_id, tag_name, tag_color)
+            )
+            self.tag_category[tag_name] = cate_name
+            self.tag_color[tag_name] = (
+                tag_color if tag_color is not None else category_color[cate_id]
+            )
+
+    @staticmethod
+    def get() -> "TagIndex":
+        version = sqlite_db.execute("PRAGMA data_version").fetchone()[0]
+        cached = _local.tag_index
+        if cached is None or cached.version != version:
+            cached = TagIndex(version)
+            _local.tag_index = cached
+        return cached
+
+    @staticmethod
+    def invalidate() -> None:
+        _local.tag_index = None
+
+    def get_category_name(self, name: str) -> str | None:
+        return self.tag_category.get(name)
+
+    def get_color(self, name: str) -> str:
+        return self.tag_color.get(name, self.default_color)
+
+    def list_tag(self, cate: str) -> "list[Tag]":
+        return self.category_tags[cate]
+
+
+def init(force: bool = False) -> None:
+    """
+    检查表结构，数据库记录的版本已经是 SCHEMA_VERSION 时跳过（force 时总是检查）
+    """
+    (version,) = sqlite_db.execute("PRAGMA user_version").fetchone()
+    if version >= SCHEMA_VERSION and not force:
+        return
     Source.init()
     File.init()
+    FileTag.init()
+    FileFts.init()
     Checksum.init()
     Category.init()
     Tag.init()
@@ -498,6 +1024,7 @@ def init() -> None:
     except TypeError:
         Category.set("", DEFAULT_COLOR)
     sqlite_db.execute("ANALYZE")
+    sqlite_db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     sqlite_db.commit()
 
 
@@ -507,4 +1034,11 @@ def purge_deleted(time: float) -> None:
 
 
 def close() -> None:
-    sqlite_db.close()
+    global _main_connection
+    if _main_connection is None:
+        return
+    Checksum.flush_lasttime()
+    # 只在统计信息过期时重新 ANALYZE，代替每次启动时的完整 ANALYZE
+    _main_connection.execute("PRAGMA optimize")
+    _main_connection.close()
+    _main_connection = None
@@ -1,33 +1,556 @@
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
+from typing import Any, BinaryIO
+import contextlib
+import hashlib
+import io
+import itertools
+import json
 import logging
+import mmap
+import os
 import shutil
 import stat
+import time
 
 from ..constants import TAG_NOMOVE, TAG_IGNORE, TAG_AS_FILE, TAG_TODO
 from .. import tagfile
+from .. import category
+from ..db import Checksum, File, batch
 from .unempty import rmtree_onexc
 
 log = logging.getLogger(__name__)
 
 
-def move_by_copy(src: str, dst: str) -> None:
+# 复制文件时每次读写的大小，缓冲区用 mmap 分配，按页对齐
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChecksumMismatch(Exception):
+    """复制的内容和文件表中的校验和不同，没有删除源文件"""
+
+
+@dataclass
+class Copied:
+    """复制得到的文件和它的校验和，由文件表线程写入 checksum 表"""
+
+    path: str
+    size: int
+    mtime: float
+    dev: int
+    ino: int
+    checksum: str
+
+
+# 源文件的实际路径 -> 文件表中的 (校验和, 大小, 修改时间)
+Expected = dict[str, tuple[str, int, float]]
+
+
+def known_checksum(file: File, realpath: str) -> str | None:
+    """文件表中的校验和，没有时按 path 或 dev+ino 查找校验和缓存"""
+    if file.checksum is not None:
+        return file.checksum
+    cached = Checksum.reuse(file.size, file.mtime, realpath, file.dev, file.ino)
+    return cached.checksum if cached is not None else None
+
+
+def expected_checksums(file: File, fpath: Path) -> Expected:
+    """移动 file 时需要校验的文件，目录时包括其中所有已知校验和的文件"""
+    if not file.is_dir:
+        checksum = known_checksum(file, str(fpath))
+        if checksum is None:
+            return {}
+        return {os.path.normpath(fpath): (checksum, file.size, file.mtime)}
+    expected: Expected = {}
+    for child in File.iter_recurse(file.path + file.name):
+        if child.is_dir:
+            continue
+        realpath = tagfile.source_translate(child.path + child.name)
+        checksum = known_checksum(child, realpath)
+        if checksum is not None:
+            expected[os.path.normpath(realpath)] = (checksum, child.size, child.mtime)
+    return expected
+
+
+def copy_hash(fsrc: io.RawIOBase, fdst: BinaryIO) -> str:
+    """用对齐的缓冲区复制文件内容，同时计算 SHA-256，每个块只读取一次"""
+    sha = hashlib.sha256()
+    with mmap.mmap(-1, COPY_BUFFER_SIZE) as buffer, memoryview(buffer) as view:
+        while n := fsrc.readinto(view):
+            sha.update(view[:n])
+            fdst.write(view[:n])
+    return sha.hexdigest()
+
+
+def move_by_copy(src: str, dst: str, expected: Expected | None = None) -> Copied | None:
     """
     通过复制文件，来移动文件
+
+    已知源文件的校验和（文件表或校验和缓存中），并且源文件的大小和修改时间没有
+    变化时，复制时计算校验和，不同时删除复制的文件并抛出 ChecksumMismatch，
+    返回复制得到的文件，用于登记校验和。否则用 shutil.copyfile 复制，不校验，
+    返回 None。
     """
     log.info(f"Move by copy: copying {src} to {dst}")
-    shutil.copy2(src, dst)
+    known = (expected or {}).get(os.path.normpath(src))
+    st = os.stat(src)
+    if known is not None and (st.st_size, st.st_mtime) != known[1:]:
+        known = None
+    if known is None:
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+        return None
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb") as fdst:
+        checksum = copy_hash(fsrc, fdst)
+    if checksum != known[0]:
+        os.unlink(dst)
+        raise ChecksumMismatch(f"checksum of {src} is {checksum}, expected {known[0]}")
+    shutil.copystat(src, dst)
+    st = os.stat(dst)
+    return Copied(
+        path=dst,
+        size=st.st_size,
+        mtime=st.st_mtime,
+        dev=tagfile.i64(st.st_dev),
+        ino=tagfile.i64(st.st_ino),
+        checksum=checksum,
+    )
+
+
+def move_path(
+    fpath: Path, dpath: Path, is_dir: bool, expected: Expected | None = None
+) -> list[Copied]:
+    """
+    移动文件或目录，移动失败（例如跨设备）时复制后删除源文件，返回复制并校验过的文件
+
+    expected 是 expected_checksums 返回的校验和，复制的内容和它不同时不删除源文件。
+    """
+    copied: list[Copied] = []
+
+    def copy_function(src: str, dst: str) -> None:
+        result = move_by_copy(src, dst, expected)
+        if result is not None:
+            copied.append(result)
+
+    if dpath.exists():
+        raise FileExistsError(f"file {dpath} already exists")
+    dpath.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fpath.rename(dpath)
+    except Exception as err:
+        # 这里的设计是，移动失败后尝试复制。即使复制后的清理失败，数据库照常更新。
+        log.info(f"Move by copy: ({err})")
+        if is_dir:
+            try:
+                shutil.copytree(fpath, dpath, copy_function=copy_function)
+            except BaseException:
+                # 复制没有完成（包括校验和不同），删除已经复制的部分，保留源文件
+                shutil.rmtree(dpath, ignore_errors=True)
+                raise
+            try:
+                shutil.rmtree(fpath, onexc=rmtree_onexc)
+            except Exception as err:
+                log.error(f"Failed to remove {fpath}: ({err})")
+        else:
+            try:
+                copy_function(str(fpath), str(dpath))
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    dpath.unlink(missing_ok=True)
+                raise
+            try:
+                fpath.chmod(stat.S_IWUSR)  # Add write permission
+                fpath.unlink()
+            except Exception as err:
+                log.error(f"Failed to remove {fpath}: ({err})")
+    return copied
+
+
+def path_device(path: Path) -> int:
+    """路径所在的设备，路径不存在时使用最近的存在的上级目录"""
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            if path.parent == path:
+                raise
+            path = path.parent
+
+
+# apply_plan 每次从文件表读取的计划项数
+PLAN_CHUNK_SIZE = 10000
+
+
+@dataclass
+class PlanEntry:
+    """
+    移动计划中的一项，计划文件每行一个 JSON 对象
+
+    src 和 dest 是文件表中的路径，dest 是目标目录。size、mtime 和 tags 是生成计划时
+    文件的状态，用于执行时检查计划是否过期。
+    """
+
+    id: int
+    src: str
+    dest: str
+    rule: str
+    size: int
+    mtime: float
+    tags: str
+    is_dir: bool
+
+    @property
+    def name(self) -> str:
+        return self.src[self.src.rfind("/") + 1 :]
+
+    @staticmethod
+    def create(file: File, dest: str, rule: str) -> "PlanEntry":
+        return PlanEntry(
+            id=file.id,
+            src=file.path + file.name,
+            dest=dest,
+            rule=rule,
+            size=file.size,
+            mtime=file.mtime,
+            tags=file.tags,
+            is_dir=bool(file.is_dir),
+        )
+
+    def dumps(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @staticmethod
+    def loads(line: str) -> "PlanEntry":
+        return PlanEntry(**json.loads(line))
+
+
+@dataclass
+class Move:
+    """一次移动：文件、实际的源路径和目标路径、文件表中的目标目录"""
+
+    file: File
+    fpath: Path
+    dpath: Path
+    dest: str
+
+
+class MoveExecutor:
+    """
+    并行执行移动
+
+    每对（源设备, 目标设备）一个线程池：同一设备内的重命名使用 rename_workers
+    个线程，跨设备的复制使用 copy_workers 个线程。文件操作成功后，由调用方线程
+    在一个事务中批量更新文件表，并登记复制得到的文件的校验和，之后刷新时不需要
+    重新计算。
+
+    移动目录前等待之前提交的移动（包括目录中的文件）全部完成并写入文件表，
+    目录移动完成后再继续提交，和逐个移动的结果相同。
+    """
+
+    def __init__(
+        self, rename_workers: int = 8, copy_workers: int = 2, batch_size: int = 1000
+    ) -> None:
+        self.rename_workers = max(1, rename_workers)
+        self.copy_workers = max(1, copy_workers)
+        self.batch_size = batch_size
+        self.pools: dict[tuple[int, int], ThreadPoolExecutor] = {}
+        # 提交的序号，按提交的顺序更新文件表
+        self.submitted = 0
+        self.running: dict[Future[list[Copied]], tuple[int, Move]] = {}
+        self.finished: list[tuple[int, Move, list[Copied]]] = []
+        # 已经提交的目标路径，同一目标只有第一个移动能执行
+        self.targets: set[Path] = set()
+
+    def __enter__(self) -> "MoveExecutor":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def submit(self, move: Move) -> None:
+        try:
+            if move.dpath in self.targets:
+                raise FileExistsError(f"file {move.dpath} already exists")
+            key = (os.lstat(move.fpath).st_dev, path_device(move.dpath.parent))
+        except Exception as err:
+            log.error(f"Failed to move {move.fpath}: ({err})")
+            return
+        self.targets.add(move.dpath)
+        if move.file.is_dir:
+            self.wait()
+        try:
+            expected = expected_checksums(move.file, move.fpath)
+        except Exception as err:
+            log.error(f"Failed to move {move.fpath}: ({err})")
+            return
+        pool = self.pools.get(key)
+        if pool is None:
+            same_device = key[0] == key[1]
+            pool = ThreadPoolExecutor(
+                self.rename_workers if same_device else self.copy_workers,
+                f"move-{key[0]}-{key[1]}",
+            )
+            self.pools[key] = pool
+        future = pool.submit(
+            move_path, move.fpath, move.dpath, move.file.is_dir, expected
+        )
+        self.running[future] = (self.submitted, move)
+        self.submitted += 1
+        if move.file.is_dir:
+            self.wait()
+        elif len(self.running) >= self.batch_size:
+            self.collect(FIRST_COMPLETED)
+
+    def collect(self, return_when: str) -> None:
+        """取出完成的移动，足够多时更新文件表"""
+        done, _ = wait(self.running, return_when=return_when)
+        for future in done:
+            seq, move = self.running.pop(future)
+            err = future.exception()
+            if err is not None:
+                log.error(f"Failed to move {move.fpath}: ({err})")
+            else:
+                self.finished.append((seq, move, future.result()))
+        if len(self.finished) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """把完成的移动写入文件表"""
+        self.finished.sort(key=lambda x: x[0])
+        with batch():
+            for _, move, copied in self.finished:
+                try:
+                    tagfile.move_file(move.file.id, move.dest, None)
+                except Exception as err:
+                    log.error(f"Failed to move {move.fpath}: ({err})")
+                for x in copied:
+                    Checksum.add(x.path, x.size, x.mtime, x.dev, x.ino, x.checksum)
+        self.finished.clear()
+
+    def wait(self) -> None:
+        """等待所有提交的移动完成，并写入文件表"""
+        self.collect(ALL_COMPLETED)
+        self.flush()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            for pool in self.pools.values():
+                pool.shutdown()
+            self.pools.clear()
+
+
+# 规则的索引键：("tag", 标签)、("cate", 分类) 或 ("ext", 小写的扩展名)
+RuleKey = tuple[str, str]
+
+
+def name_ext(name: str) -> str | None:
+    """名称中最后一个 . 开始的部分（小写），没有 . 时返回 None"""
+    pos = name.rfind(".")
+    if pos == -1:
+        return None
+    return name[pos:].lower()
+
+
+def required_keys(
+    cond: tagfile.Condition, disable_sym: bool = False
+) -> set[RuleKey] | None:
+    """
+    条件的必要条件：匹配的文件一定有返回的键中的至少一个，无法确定时返回 None
+
+    和 Filter.compile_condition 一样解析条件。+标签 需要这个标签，~分类 需要
+    这个分类中的一个标签，*.ext 这样的名称通配符需要这个扩展名，其他条件
+    （-标签、!条件、子串等）不提供限制。
+    """
+    if isinstance(cond, list):
+        # OR：每个 AND 组的必要条件的并集
+        keys: set[RuleKey] = set()
+        for and_group in cond:
+            group_keys = required_and_keys(and_group)
+            if group_keys is None:
+                return None
+            keys |= group_keys
+        return keys
+    arg = cond
+    if arg[0] == arg[-1] == '"':
+        return required_keys(arg[1:-1], True)
+    if disable_sym:
+        literal = arg[1:]
+        if arg[0] == "*" and "." in literal and not any(x in literal for x in "*?[]/"):
+            ext = literal[literal.rfind(".") :].lower()
+            # 非 ASCII 字符在忽略大小写时的匹配和 lower() 不完全一致
+            if ext.isascii():
+                return {("ext", ext)}
+        return None
+    if arg[0] == "+" and arg[1:] != "":
+        return {("tag", arg[1:])}
+    if arg[0] == "~":
+        return {("cate", arg[1:])}
+    if arg[0] in "+-!":
+        return None
+    return required_keys(arg, True)
+
+
+def required_and_keys(conditions: tagfile.AndConditions) -> set[RuleKey] | None:
+    """AND 组的必要条件：任一条件的必要条件都可以，选择最有区分度的"""
+    best: set[RuleKey] | None = None
+    best_cost = None
+    for cond in conditions:
+        keys = required_keys(cond)
+        if keys is None:
+            continue
+        # 扩展名通常比标签和分类常见，同样的情况下键越少越好
+        cost = (any(key[0] == "ext" for key in keys), len(keys))
+        if best_cost is None or cost < best_cost:
+            best, best_cost = keys, cost
+    return best
+
+
+@dataclass
+class RuleStats:
+    """automove 中规则的测试次数、匹配次数和耗时"""
+
+    files: int = 0
+    # 使用索引时实际测试的次数，和按顺序测试所有规则时需要的次数
+    evaluations: int = 0
+    linear_evaluations: int = 0
+    seconds: float = 0.0
+    rule_evaluations: list[int] = field(default_factory=list)
+    rule_matches: list[int] = field(default_factory=list)
+    rule_seconds: list[float] = field(default_factory=list)
+    rules: list[str] = field(default_factory=list)
+
+    def report(self) -> str:
+        lines = [
+            f"文件 {self.files} 个，测试规则 {self.evaluations} 次"
+            f"（逐条测试需要 {self.linear_evaluations} 次），"
+            f"耗时 {self.seconds * 1000:.1f} ms",
+            "   测试     匹配   耗时(ms)  规则",
+        ]
+        for i, rule in enumerate(self.rules):
+            lines.append(
+                f"{self.rule_evaluations[i]:7d}  {self.rule_matches[i]:7d}"
+                f"  {self.rule_seconds[i] * 1000:9.1f}  {rule}"
+            )
+        return "\n".join(lines)
+
+
+class RuleSet:
+    """
+    编译后的移动规则
+
+    按规则需要的标签、分类和扩展名建立索引，每个文件只测试可能匹配的规则。
+    候选规则按规则文件中的顺序测试，第一个匹配的规则和逐条测试时相同。
+    """
+
+    def __init__(
+        self,
+        rules: list[tuple[tagfile.Filter | None, str, str]],
+        stats: RuleStats | None = None,
+    ) -> None:
+        self.rules = rules
+        self.stats = stats
+        self.tag_category = category.tag_index().tag_category
+        self.all = list(range(len(rules)))
+        # 没有必要条件的规则，每个文件都要测试
+        self.always: list[int] = []
+        self.index: dict[RuleKey, list[int]] = {}
+        for i, (filter_, _, _) in enumerate(rules):
+            keys = None if filter_ is None else required_keys(filter_.expression)
+            if keys is None:
+                self.always.append(i)
+            else:
+                for key in keys:
+                    self.index.setdefault(key, []).append(i)
+        # 候选规则只和标签、扩展名有关，很多文件相同
+        self.cache: dict[tuple[str, str | None], list[int]] = {}
+        if stats is not None:
+            stats.rule_evaluations = [0] * len(rules)
+            stats.rule_matches = [0] * len(rules)
+            stats.rule_seconds = [0.0] * len(rules)
+            stats.rules = [text for _, _, text in rules]
+
+    def candidates(self, file: File) -> list[int]:
+        """可能匹配文件的规则的序号，按规则顺序排列"""
+        start = time.perf_counter()
+        ext = name_ext(file.name)
+        if ext is not None and not ext.isascii():
+            result = self.all
+        else:
+            result = self.cache.get((file.tags, ext))
+            if result is None:
+                found = set(self.always)
+                for tag in file.tags.split(" "):
+                    found.update(self.index.get(("tag", tag), ()))
+                    cate = self.tag_category.get(tag)
+                    if cate is not None:
+                        found.update(self.index.get(("cate", cate), ()))
+                if ext is not None:
+                    found.update(self.index.get(("ext", ext), ()))
+                result = self.cache[(file.tags, ext)] = sorted(found)
+        if self.stats is not None:
+            self.stats.files += 1
+            # 假设没有规则匹配，apply 匹配时再修正
+            self.stats.linear_evaluations += len(self.rules)
+            self.stats.seconds += time.perf_counter() - start
+        return result
+
+    def apply(self, i: int, file: File) -> tuple[bool, dict[str, list[str]]]:
+        """测试第 i 条规则，返回 (是否匹配成功, 匹配的组)"""
+        filter_ = self.rules[i][0]
+        if self.stats is None:
+            if filter_ is None:
+                return True, {}
+            return tagfile.apply_filter(filter_, file)
+        start = time.perf_counter()
+        if filter_ is None:
+            result: tuple[bool, dict[str, list[str]]] = (True, {})
+        else:
+            result = tagfile.apply_filter(filter_, file)
+        seconds = time.perf_counter() - start
+        self.stats.evaluations += 1
+        self.stats.seconds += seconds
+        self.stats.rule_evaluations[i] += 1
+        self.stats.rule_seconds[i] += seconds
+        if result[0]:
+            self.stats.rule_matches[i] += 1
+            self.stats.linear_evaluations -= len(self.rules) - i - 1
+        return result
 
 
 def automove(
-    path: str, moverule: str, dry_run: bool = True, mark_missed: bool = False
+    path: str,
+    moverule: str,
+    dry_run: bool = True,
+    mark_missed: bool = False,
+    stats: RuleStats | None = None,
+    rename_workers: int = 8,
+    copy_workers: int = 2,
+    plan: str | None = None,
 ) -> int:
     """
-    根据规则移动文件
+    根据规则移动文件，stats 不为 None 时记录规则的测试次数和耗时
+
+    文件操作由 MoveExecutor 并行执行，rename_workers 和 copy_workers 是每对设备
+    同一设备内和跨设备移动的线程数。
+
+    plan 不为 None 时不移动文件（和 dry_run 相同），把要进行的移动写入这个计划
+    文件，之后用 apply_plan 执行。
     """
+    if plan is not None:
+        dry_run = True
     moved_count = 0
     with open(moverule, "r", encoding="utf-8") as f:
         rules = f.readlines()
-    rules_cooked: list[tuple[list[tagfile.AndConditions] | None, str, str]] = []
+    rules_cooked: list[tuple[tagfile.Filter | None, str, str]] = []
     for rule in rules:
         rule = rule.strip()
         if rule == "" or rule.startswith("#"):
@@ -41,13 +564,16 @@ def automove(
             dest += "/"
         filter_list = tagfile.arglist(filter_)
         rules_cooked.append((filter_list, dest, filter_))
+    ruleset = RuleSet(rules_cooked, stats)
+
+    tree = tagfile.FileTree(path)
 
     def walk(path: str) -> None:
         """
         递归遍历目录，根据规则移动文件
         """
         nonlocal moved_count
-        for file in tagfile.list_file(path):
+        for file in tree.list(path):
             tags = file.tags.split(" ")
             if TAG_NOMOVE in tags or TAG_IGNORE in tags:
                 continue
@@ -58,14 +584,11 @@ def automove(
             # 处理文件
             file_missed = True
             fpath = Path(tagfile.source_translate(file.path + file.name))
-            for filter_list, dest, filter_ in rules_cooked:
-                if filter_list is None:
-                    matched = True
-                    catetag = {}
-                else:
-                    matched, catetag = tagfile.apply_filter(filter_list, file)
+            for i in ruleset.candidates(file):
+                matched, catetag = ruleset.apply(i, file)
                 if not matched:
                     continue
+                _, dest, filter_ = rules_cooked[i]
                 file_missed = False
                 checked = True
                 for cate, ctags in catetag.items():
@@ -104,6 +627,10 @@ def automove(
                         log.info(f"      (to) {dpath}")
                         log.info(f"     match {filter_}")
                         log.info("")
+                        if plan_file is not None:
+                            plan_file.write(
+                                PlanEntry.create(file, dest, filter_).dumps() + "\n"
+                            )
                     else:
                         log.info(f"  move {file.path + file.name}")
                         log.info(f"    to {dest + file.name}")
@@ -111,35 +638,7 @@ def automove(
                         log.info(f"  (to) {dpath}")
                         log.info(f" match {filter_}")
                         log.info("")
-                        try:
-                            if dpath.exists():
-                                raise FileExistsError(f"file {dpath} already exists")
-                            dpath.parent.mkdir(parents=True, exist_ok=True)
-                            try:
-                                fpath.rename(dpath)
-                            except Exception as err:
-                                # 这里的设计是，移动失败后尝试复制。即使复制后的清理失败，数据库照常更新。
-                                log.info(f"Move by copy: ({err})")
-                                if file.is_dir:
-                                    shutil.copytree(
-                                        fpath, dpath, copy_function=move_by_copy
-                                    )
-                                    try:
-                                        shutil.rmtree(fpath, onexc=rmtree_onexc)
-                                    except Exception as err:
-                                        log.error(f"Failed to remove {fpath}: ({err})")
-                                else:
-                                    move_by_copy(str(fpath), str(dpath))
-                                    try:
-                                        fpath.chmod(
-                                            stat.S_IWUSR
-                                        )  # Add write permission
-                                        fpath.unlink()
-                                    except Exception as err:
-                                        log.error(f"Failed to remove {fpath}: ({err})")
-                            tagfile.move_file(file.id, dest, None)
-                        except Exception as err:
-                            log.error(f"Failed to move {fpath}: ({err})")
+                        executor.submit(Move(file, fpath, dpath, dest))
                 break
             if file_missed and mark_missed:
                 if dry_run:
@@ -154,5 +653,69 @@ def automove(
                     log.error("")
                     tagfile.tag_file_change(file.id, [TAG_TODO], [])
 
-    walk(path)
+    plan_file = open(plan, "w", encoding="utf-8") if plan is not None else None
+    try:
+        with MoveExecutor(rename_workers, copy_workers) as executor:
+            walk(path)
+    finally:
+        if plan_file is not None:
+            plan_file.close()
     return moved_count
+
+
+def stale_reason(entry: PlanEntry, file: File | None, fpath: Path) -> str | None:
+    """计划中的一项过期的原因，没有过期时返回 None"""
+    if file is None:
+        return "not in file table"
+    if file.path + file.name != entry.src:
+        return f"moved to {file.path + file.name}"
+    if file.tags != entry.tags:
+        return "tags changed"
+    # 目录中的文件移动后，目录的大小和修改时间会变化，不检查
+    if not entry.is_dir:
+        try:
+            st = os.lstat(fpath)
+        except FileNotFoundError:
+            return "file not found"
+        if st.st_size != entry.size or st.st_mtime != entry.mtime:
+            return "file modified"
+    return None
+
+
+def apply_plan(
+    plan: str, rename_workers: int = 8, copy_workers: int = 2
+) -> tuple[int, int]:
+    """
+    执行 automove 生成的移动计划，返回 (移动的数量, 过期跳过的数量)
+
+    不再测试规则，只检查每一项是否过期：文件表中的位置或标签变化了，或者文件的
+    大小和修改时间和生成计划时不同。文件表按 PLAN_CHUNK_SIZE 项一次查询。
+    """
+    moved_count = 0
+    stale_count = 0
+    with open(plan, "r", encoding="utf-8") as f, MoveExecutor(
+        rename_workers, copy_workers
+    ) as executor:
+        entries = (PlanEntry.loads(line) for line in f if line.strip() != "")
+        for chunk in itertools.batched(entries, PLAN_CHUNK_SIZE):
+            files = {file.id: file for file in File.list_id([x.id for x in chunk])}
+            for entry in chunk:
+                try:
+                    fpath = Path(tagfile.source_translate(entry.src))
+                    dpath = Path(tagfile.source_translate(entry.dest + entry.name))
+                except Exception as err:
+                    log.error(f"Failed to move {entry.src}: ({err})")
+                    continue
+                file = files.get(entry.id)
+                reason = stale_reason(entry, file, fpath)
+                if file is None or reason is not None:
+                    log.warning(f"Skip {entry.src}: {reason}")
+                    stale_count += 1
+                    continue
+                log.info(f"  move {entry.src}")
+                log.info(f"    to {entry.dest + entry.name}")
+                log.info(f" match {entry.rule}")
+                log.info("")
+                executor.submit(Move(file, fpath, dpath, entry.dest))
+                moved_count += 1
+    return moved_count, stale_count
@@ -1,28 +1,34 @@
 from .. import category
 from .. import tagfile
+from ..db import File, TagIndex
 
 
-def tags_key(tag: str) -> tuple[bool, str, str]:
-    cate = category.get_category_name(tag)
-    if cate is None:
-        return (True, "", tag)
-    return (False, cate, tag)
+def tags_order(index: TagIndex) -> dict[str, tuple[bool, str, str]]:
+    """所有已知标签的排序键，按分类名和标签名排序，未知的标签不在其中（排在最后）"""
+    return {tag: (False, cate, tag) for tag, cate in index.tag_category.items()}
 
 
 def sorttag(path: str) -> int:
-    finish_count = 0
+    """
+    按分类排序子目录中所有文件的标签，返回修改的文件数
 
-    def walk(path: str) -> None:
-        nonlocal finish_count
-        for file in tagfile.list_file(path):
-            tags = file.tags.split(" ")
-            tags.sort(key=tags_key)
-            sorted_tag = " ".join(tags)
-            if sorted_tag != file.tags:
-                tagfile.tag_file(file.id, tags)
-                finish_count += 1
-            if file.is_dir:
-                walk(file.path + file.name)
+    一次范围查询遍历整个子目录，排序键预先计算，相同的标签只排序一次，
+    修改在最后用一个事务写入。
+    """
+    order = tags_order(category.tag_index())
 
-    walk(path)
-    return finish_count
+    def key(tag: str) -> tuple[bool, str, str]:
+        k = order.get(tag)
+        return k if k is not None else (True, "", tag)
+
+    sorted_tags: dict[str, str] = {}
+    changes: list[tuple[str, int]] = []
+    for file in File.iter_recurse(tagfile.path_normalize(path)):
+        result = sorted_tags.get(file.tags)
+        if result is None:
+            result = " ".join(sorted(file.tags.split(" "), key=key))
+            sorted_tags[file.tags] = result
+        if result != file.tags:
+            changes.append((result, file.id))
+    File.set_tags_many(changes)
+    return len(changes)
@@ -16,7 +16,7 @@ import time
 log = logging.getLogger(__name__)
 
 from ..constants import TAG_TODO, TAG_AS_FILE, TAG_IGNORE, TAG_NOMOVE, DEFAULT_COLOR
-from ..db import File
+from ..db import File, batch
 from .. import tagfile
 from .. import category
 from . import singlefilerename
@@ -127,10 +127,11 @@ def tag_set(file: File, tag: str, set_: bool = True):
 
 def tagspaces_import(path: str) -> int:
     finish_count = 0
+    tree = tagfile.FileTree(path)
 
     def walk(path: str) -> None:
         nonlocal finish_count
-        for file in tagfile.list_file(path):
+        for file in tree.list(path):
             path = tagfile.source_translate(file.path + file.name)
             realname, tags = tagspaces_tags_get(Path(path))
             tag_new = False
@@ -143,7 +144,8 @@ def tagspaces_import(path: str) -> int:
             if file.is_dir:
                 walk(file.path + file.name)
 
-    walk(path)
+    with batch():
+        walk(path)
     return finish_count
 
 
@@ -155,9 +157,11 @@ def tagspaces_export(path: str, dry_run: bool = False, singlefile: bool = False)
     if singlefile:
         singlefilerename.init()
 
+    tree = tagfile.FileTree(path)
+
     def walk(path: str, nomove: bool = False) -> None:
         nonlocal finish_count
-        for file in tagfile.list_file(path):
+        for file in tree.list(path):
             if file.is_dir:
                 hasnomove = TAG_NOMOVE in file.tags.split(
                     " "
@@ -1,5 +1,5 @@
 from .. import tagfile
-from ..db import File
+from ..db import File, batch
 from .numbering import send
 from ..constants import TAG_TODO, TAG_AS_FILE, TAG_TOREAD
 
@@ -16,11 +16,13 @@ def tag_set(file: File, tag: str, set_: bool = True):
             tagfile.tag_file_change(file.id, adds=[], removes=[tag])
 
 
-def cleartag(path: str):
-    for file in tagfile.list_file(path):
+def cleartag(path: str, tree: tagfile.FileTree | None = None):
+    if tree is None:
+        tree = tagfile.FileTree(path)
+    for file in tree.list(path):
         tagfile.tag_file(file.id, [])
         if file.is_dir:
-            cleartag(file.path + file.name)
+            cleartag(file.path + file.name, tree)
 
 
 def totag(
@@ -32,11 +34,12 @@ def totag(
     todo_count = 0
     finish_count = 0
     toread_count = 0
+    tree = tagfile.FileTree(path)
 
     def walk(path: str) -> bool:
         nonlocal todo_count, finish_count, toread_count
         sum_tag = False
-        for file in tagfile.list_file(path):
+        for file in tree.list(path):
             if file.is_dir and not tag_has(file, TAG_AS_FILE):
                 set_tag = walk(file.path + file.name)
                 tag_set(file, TAG_TODO, set_tag)
@@ -45,7 +48,7 @@ def totag(
             else:
                 if file.is_dir and tag_has(file, TAG_AS_FILE):
                     if clear_file_tags:
-                        cleartag(file.path + file.name)
+                        cleartag(file.path + file.name, tree)
                 if tag_has(file, TAG_TOREAD):
                     toread_count += 1
                 if markall:
@@ -60,7 +63,8 @@ def totag(
                         finish_count += 1
         return sum_tag
 
-    walk(path)
+    with batch():
+        walk(path)
     if send_number:
         send("tagspaces", "#ff0000", 2, todo_count)
         send("tagspaces_todo", "#ff00ff", 2, toread_count)
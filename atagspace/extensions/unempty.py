@@ -41,11 +41,12 @@ def rmdir(file: File):
 
 def unempty(path: str, dry_run: bool = False) -> int:
     finish_count = 0
+    tree = tagfile.FileTree(path)
 
     def walk(path: str) -> bool:
         nonlocal finish_count
         keep_file = False
-        for file in tagfile.list_file(path):
+        for file in tree.list(path):
             tags = file.tags.split(" ")
             if (
                 file.is_dir
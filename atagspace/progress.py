@@ -0,0 +1,16 @@
+from typing import Any
+
+_configured = False
+
+
+def alive_bar(*args: Any, **kwargs: Any) -> Any:
+    """
+    alive_progress.alive_bar，第一次使用时才导入 alive_progress（导入较慢）
+    """
+    global _configured
+    from alive_progress import alive_bar, config_handler
+
+    if not _configured:
+        config_handler.set_global(enrich_print=False, dual_line=True, length=10)  # type: ignore
+        _configured = True
+    return alive_bar(*args, **kwargs)
@@ -0,0 +1,375 @@
+from typing import Iterable, Hashable
+import time
+import logging
+
+from .db import Checksum, File
+from .progress import alive_bar
+from . import checker
+from .constants import TAG_TODO
+from . import tagfile  # circular!
+
+log = logging.getLogger(__name__)
+
+
+def _put(index: dict[Hashable, dict[int, File]], key: Hashable, file: File) -> None:
+    index.setdefault(key, {})[id(file)] = file
+
+
+def _pop(index: dict[Hashable, dict[int, File]], key: Hashable, file: File) -> None:
+    files = index.get(key)
+    if files is not None:
+        files.pop(id(file), None)
+        if not files:
+            del index[key]
+
+
+def _first(index: dict[Hashable, dict[int, File]], key: Hashable) -> File | None:
+    files = index.get(key)
+    if files is None:
+        return None
+    return next(iter(files.values()))
+
+
+class FileIndex:
+    """
+    文件表的内存索引
+
+    载入时把所有未删除的记录在内存中标记为删除，匹配过程只修改内存中的记录，
+    只有实际发生变化的记录才会写入数据库，最后未再出现的记录标记为删除。
+    """
+
+    def __init__(self, files: Iterable[File], now: float) -> None:
+        self.now = now
+        # 同一个键的多条记录按 id 顺序排列，查找时返回第一条
+        self.path_name: dict[Hashable, dict[int, File]] = {}
+        self.path: dict[Hashable, dict[int, File]] = {}
+        self.dev_ino: dict[Hashable, dict[int, File]] = {}
+        self.size_checksum: dict[Hashable, dict[int, File]] = {}
+        self.size_count: dict[int, int] = {}
+        self.size_tagged: dict[int, int] = {}
+        # 数据库中未删除的记录
+        self.stored_live: set[int] = set()
+        # 数据库中未删除，但这次还没有出现的记录
+        self.unseen: dict[int, File] = {}
+        for file in files:
+            if file.deltime is None:
+                self.stored_live.add(file.id)
+                self.unseen[file.id] = file
+                file.deltime = now
+            self._add(file)
+
+    @staticmethod
+    def load() -> "FileIndex":
+        return FileIndex(File.list_all(), time.time())
+
+    def _add(self, file: File) -> None:
+        _put(self.path_name, (file.path, file.name), file)
+        _put(self.path, file.path, file)
+        if file.dev != 0 and file.ino != 0:
+            _put(self.dev_ino, (file.dev, file.ino), file)
+        if file.checksum is not None:
+            _put(self.size_checksum, (file.size, file.checksum), file)
+        self.size_count[file.size] = self.size_count.get(file.size, 0) + 1
+        if file.tags != "":
+            self.size_tagged[file.size] = self.size_tagged.get(file.size, 0) + 1
+
+    def _remove(self, file: File) -> None:
+        _pop(self.path_name, (file.path, file.name), file)
+        _pop(self.path, file.path, file)
+        _pop(self.dev_ino, (file.dev, file.ino), file)
+        if file.checksum is not None:
+            _pop(self.size_checksum, (file.size, file.checksum), file)
+        self.size_count[file.size] -= 1
+        if file.tags != "":
+            self.size_tagged[file.size] -= 1
+
+    def get_path_name(self, path: str, name: str) -> File | None:
+        return _first(self.path_name, (path, name))
+
+    def get_dev_ino(self, dev: int, ino: int) -> File | None:
+        if ino == 0 or dev == 0:
+            return None
+        return _first(self.dev_ino, (dev, ino))
+
+    def has_size(self, size: int, include_notag: bool) -> bool:
+        count = self.size_count if include_notag else self.size_tagged
+        return count.get(size, 0) > 0
+
+    def get_size_checksum(
+        self, size: int, checksum: str, include_notag: bool = True
+    ) -> File | None:
+        files = self.size_checksum.get((size, checksum))
+        if files is None:
+            return None
+        return next((x for x in files.values() if include_notag or x.tags != ""), None)
+
+    def create(
+        self,
+        listfile: "tagfile.ListFile",
+        checksum: str | None,
+        tags: str = TAG_TODO,
+    ) -> None:
+        tagfile.create_file(listfile, checksum, tags)
+        # 新记录的 id 未知，它只会作为复制的来源被查找到
+        self._add(
+            File(
+                id=0,
+                path=listfile.path,
+                name=listfile.name,
+                size=listfile.size,
+                mtime=listfile.mtime,
+                dev=listfile.dev,
+                ino=listfile.ino,
+                checksum=checksum,
+                is_dir=listfile.is_dir,
+                tags=tags,
+                deltime=None,
+            )
+        )
+
+    def update(
+        self,
+        existing: File,
+        listfile: "tagfile.ListFile | File",
+        checksum: str | None,
+    ) -> None:
+        old = (
+            existing.path,
+            existing.name,
+            existing.size,
+            existing.mtime,
+            existing.dev,
+            existing.ino,
+            existing.checksum,
+            existing.is_dir,
+        )
+        new = (
+            listfile.path,
+            listfile.name,
+            listfile.size,
+            listfile.mtime,
+            listfile.dev,
+            listfile.ino,
+            checksum,
+            listfile.is_dir,
+        )
+        self.unseen.pop(existing.id, None)
+        self._remove(existing)
+        existing.path = listfile.path
+        existing.name = listfile.name
+        existing.size = listfile.size
+        existing.mtime = listfile.mtime
+        existing.dev = listfile.dev
+        existing.ino = listfile.ino
+        existing.checksum = checksum
+        existing.is_dir = listfile.is_dir
+        existing.deltime = None
+        self._add(existing)
+        if old != new or existing.id not in self.stored_live:
+            existing.self_update()
+            self.stored_live.add(existing.id)
+
+    def keep(self, path: str, full: bool = False) -> list[File]:
+        """
+        目录没有变化，目录中的文件(不包括子目录)保持原样
+
+        返回其中还没有校验和、需要计算的文件，条件和 reconcile 中相同。
+        和重新列出的文件一样，按 path 或 dev+ino 记录它们的校验和被使用。
+        """
+        files = self.path.get(path)
+        if files is None:
+            return []
+        tocheck: list[File] = []
+        for file in files.values():
+            if not file.is_dir and self.unseen.pop(file.id, None) is not None:
+                file.deltime = None
+                checker.check(file, cache_only=True)
+                if file.checksum is None and (
+                    full or tagfile.has_normal_tag(file.tags)
+                ):
+                    tocheck.append(file)
+        return tocheck
+
+    def finish(self) -> None:
+        """把没有再出现的记录标记为删除"""
+        for file in self.unseen.values():
+            File.set_deltime(file.id, self.now)
+            self.stored_live.discard(file.id)
+        self.unseen.clear()
+
+
+class FileTable:
+    """
+    直接查询数据库的文件表索引，接口和 FileIndex 相同
+
+    用于只有少量文件需要对照的情况（例如监视文件变化），不需要载入整个文件表。
+    """
+
+    def get_path_name(self, path: str, name: str) -> File | None:
+        return File.reuse_get_path_name(path, name)
+
+    def get_dev_ino(self, dev: int, ino: int) -> File | None:
+        return File.reuse_get_dev_ino(dev, ino)
+
+    def has_size(self, size: int, include_notag: bool) -> bool:
+        return File.reuse_has_size(size, include_notag)
+
+    def get_size_checksum(
+        self, size: int, checksum: str, include_notag: bool = True
+    ) -> File | None:
+        existing = File.reuse_get_size_checksum(size, checksum)
+        if existing is not None and not include_notag and existing.tags == "":
+            return None
+        return existing
+
+    def create(
+        self,
+        listfile: "tagfile.ListFile",
+        checksum: str | None,
+        tags: str = TAG_TODO,
+    ) -> None:
+        tagfile.create_file(listfile, checksum, tags)
+
+    def update(
+        self,
+        existing: File,
+        listfile: "tagfile.ListFile | File",
+        checksum: str | None,
+    ) -> None:
+        existing.path = listfile.path
+        existing.name = listfile.name
+        existing.size = listfile.size
+        existing.mtime = listfile.mtime
+        existing.dev = listfile.dev
+        existing.ino = listfile.ino
+        existing.checksum = checksum
+        existing.is_dir = listfile.is_dir
+        existing.deltime = None
+        existing.self_update()
+
+    def finish(self) -> None:
+        pass
+
+
+def reconcile(
+    filelist: list["tagfile.ListFile"],
+    index: FileIndex | FileTable,
+    full: bool = False,
+    hash_workers: int = 4,
+    quiet: bool = False,
+    carried: Iterable[File] = (),
+) -> None:
+    """
+    把扫描到的文件列表和文件表对照，更新文件表
+
+    carried 是没有重新列出（增量扫描时保留）但需要计算校验和的记录，
+    quiet 为 True 时不显示进度条
+    """
+    # 用 id() 去重，同一条记录只需要计算一次
+    tocheck: dict[int, File] = {id(file): file for file in carried}
+    newcheck: list[tagfile.ListFile] = []
+
+    # 文件已经记录(path+name)？更新记录
+    filelist2: list[tagfile.ListFile] = []
+    with alive_bar(len(filelist), title="Update", disable=quiet) as bar:
+        for file in filelist:
+            existing = index.get_path_name(file.path, file.name)
+            if existing is not None:
+                checksum = checker.check(file, cache_only=True)
+                index.update(existing, file, checksum)
+                if not existing.is_dir and existing.checksum is None:
+                    if full or tagfile.has_normal_tag(existing.tags):
+                        tocheck[id(existing)] = existing
+            else:
+                filelist2.append(file)
+            bar()
+    Checksum.flush_lasttime()
+
+    # 否则，查找相同的文件(dev+ino)
+    filelist = filelist2
+    filelist2 = []
+    with alive_bar(len(filelist), title="Inode", disable=quiet) as bar:
+        for file in filelist:
+            existing = index.get_dev_ino(file.dev, file.ino)
+            if existing is not None:
+                checksum = checker.check(file, cache_only=True)
+                if existing.deltime is None:
+                    log.info(f"Copy: {existing.path}{existing.name}")
+                    log.info(f"   -> {file.path}{file.name}")
+                    index.create(file, checksum, tags=existing.tags)
+                else:
+                    log.info(f"Move: {existing.path}{existing.name}")
+                    log.info(f"   -> {file.path}{file.name}")
+                    index.update(existing, file, checksum)
+                if not existing.is_dir and existing.checksum is None:
+                    if full or existing.tags:
+                        tocheck[id(existing)] = existing
+            else:
+                if file.is_dir:
+                    index.create(file, None)
+                else:
+                    filelist2.append(file)
+            bar()
+    Checksum.flush_lasttime()
+
+    # 否则，查找相同的文件(size+checksum)
+    filelist = filelist2
+    with alive_bar(len(filelist), title="Size", disable=quiet) as bar:
+        for file in filelist:
+            checksum = checker.check(file, cache_only=True)
+            if index.has_size(file.size, full) or full:
+                if checksum is None:
+                    # 快速指纹和同样大小的文件都不同时，不需要计算完整的校验和
+                    if full or checker.may_duplicate(file, full):
+                        newcheck.append(file)
+                    else:
+                        index.create(file, None)
+                else:
+                    existing = index.get_size_checksum(file.size, checksum, full)
+                    if existing is not None:
+                        if existing.deltime is None:
+                            log.info(f"Copy: {existing.path}{existing.name}")
+                            log.info(f"   -> {file.path}{file.name}")
+                            index.create(file, checksum, tags=existing.tags)
+                        else:
+                            log.info(f"Move: {existing.path}{existing.name}")
+                            log.info(f"   -> {file.path}{file.name}")
+                            index.update(existing, file, checksum)
+                    else:
+                        index.create(file, checksum)
+            else:
+                index.create(file, checksum)
+            bar()
+    Checksum.flush_lasttime()
+
+    with alive_bar(
+        sum(x.size for x in tocheck.values()) + sum(x.size for x in newcheck),
+        title="Sha256",
+        unit="B",
+        scale="SI",
+        disable=quiet,
+    ) as bar:
+        for file, checksum in checker.check_many(tocheck.values(), hash_workers):
+            bar.text(file.path + file.name)
+            index.update(file, file, checksum)
+            bar(file.size)
+        for file, checksum in checker.check_many(newcheck, hash_workers):
+            bar.text(file.path + file.name)
+            if checksum is None:
+                continue
+            existing = index.get_size_checksum(file.size, checksum)
+            if existing is not None:
+                if existing.deltime is None:
+                    log.info(f"Copy: {existing.path}{existing.name}")
+                    log.info(f"   -> {file.path}{file.name}")
+                    index.create(file, checksum, tags=existing.tags)
+                else:
+                    log.info(f"Move: {existing.path}{existing.name}")
+                    log.info(f"   -> {file.path}{file.name}")
+                    index.update(existing, file, checksum)
+            else:
+                index.create(file, checksum)
+            bar(file.size)
+    Checksum.flush_lasttime()
+
+    index.finish()
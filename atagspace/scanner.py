@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import os
+import queue
+import threading
+import time
+import logging
+
+from .db import File, Source
+from . import tagfile  # circular!
+
+log = logging.getLogger(__name__)
+
+
+class Scanner:
+    """
+    并行目录扫描
+
+    每个设备一个线程池（workers 个线程），目录作为任务提交到所在设备的线程池，
+    扫描结果按目录汇总到同一个队列，由调用方线程逐个取出。
+
+    增量扫描时传入上次扫描时各目录的修改时间和子目录，修改时间没有变化的目录
+    不再列出内容，只检查已知的子目录，目录路径记录在 carried 中。
+    直接修改文件内容不会改变目录的修改时间，这样的目录中文件大小、修改时间和
+    内容的变化在增量扫描中发现不了，需要定期完整扫描。
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        dir_mtimes: dict[str, float] | None = None,
+        subdirs: dict[str, list[str]] | None = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.dir_mtimes = dir_mtimes
+        self.subdirs = subdirs if subdirs is not None else {}
+        self.carried: list[str] = []
+        self.pools: dict[int, ThreadPoolExecutor] = {}
+        self.results: "queue.SimpleQueue[tuple[str, list[tagfile.ListFile]] | None]" = (
+            queue.SimpleQueue()
+        )
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, dev: int, realdir: str, path: str, mtime: float) -> None:
+        with self.lock:
+            self.pending += 1
+            pool = self.pools.get(dev)
+            if pool is None:
+                pool = ThreadPoolExecutor(self.workers, f"scan-{dev}")
+                self.pools[dev] = pool
+        pool.submit(self.scan_dir, dev, realdir, path, mtime)
+
+    def scan_dir(self, dev: int, realdir: str, path: str, mtime: float) -> None:
+        try:
+            files: list[tagfile.ListFile] = []
+            subdirs: list[tuple[str, str, float]] = []
+            if self.dir_mtimes is not None and self.dir_mtimes.get(path) == mtime:
+                self.carried.append(path)
+                for name in self.subdirs.get(path, []):
+                    try:
+                        subdir = os.path.join(realdir, name)
+                        stat = os.lstat(subdir)
+                        files.append(
+                            tagfile.ListFile(
+                                path=path,
+                                name=name,
+                                size=stat.st_size,
+                                mtime=stat.st_mtime,
+                                dev=tagfile.i64(stat.st_dev),
+                                ino=tagfile.i64(stat.st_ino),
+                                is_dir=True,
+                            )
+                        )
+                        subdirs.append((subdir, path + name + "/", stat.st_mtime))
+                    except Exception as err:
+                        log.error(f"Error stat {path}{name}: {err}")
+                for subdir, subpath, submtime in subdirs:
+                    self.submit(dev, subdir, subpath, submtime)
+                self.results.put((path, files))
+                return
+            with os.scandir(realdir) as it:
+                for entry in it:
+                    # filter ".xx's"
+                    if entry.name[0] == ".":
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat = entry.stat(follow_symlinks=False)
+                        # Windows 下 DirEntry 的 stat 结果中 st_dev, st_ino 总是 0
+                        ino = stat.st_ino or entry.inode()
+                        files.append(
+                            tagfile.ListFile(
+                                path=path,
+                                name=entry.name,
+                                size=stat.st_size,
+                                mtime=stat.st_mtime,
+                                dev=tagfile.i64(stat.st_dev or dev),
+                                ino=tagfile.i64(ino),
+                                is_dir=is_dir,
+                            )
+                        )
+                        if is_dir:
+                            subdirs.append(
+                                (entry.path, path + entry.name + "/", stat.st_mtime)
+                            )
+                    except Exception as err:
+                        log.error(f"Error stat {path}{entry.name}: {err}")
+            for subdir, subpath, submtime in subdirs:
+                self.submit(dev, subdir, subpath, submtime)
+            self.results.put((path, files))
+        except Exception as err:
+            log.error(f"Error list {path}: {err}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+            # 唤醒 run()，由 run() 检查是否全部完成
+            self.results.put(None)
+
+    def scan(
+        self, sources: list[Source]
+    ) -> Iterator[tuple[str, list["tagfile.ListFile"]]]:
+        """
+        扫描所有文件源，每扫描完一个目录返回 (目录路径, 目录内容)
+        """
+        roots: list[tagfile.ListFile] = []
+        for source in sources:
+            roots.append(
+                tagfile.ListFile(
+                    path="/",
+                    name=source.name,
+                    size=0,
+                    mtime=time.time(),
+                    dev=0,
+                    ino=0,
+                    is_dir=True,
+                )
+            )
+            try:
+                stat = os.stat(source.path)
+            except Exception as err:
+                log.error(f"Error stat source {source.name}: {err}")
+                continue
+            self.submit(
+                stat.st_dev, source.path, "/" + source.name + "/", stat.st_mtime
+            )
+        try:
+            yield "/", roots
+            yield from self.run()
+        finally:
+            self.close()
+
+    def run(self) -> Iterator[tuple[str, list["tagfile.ListFile"]]]:
+        """
+        返回已提交的目录及其子目录的扫描结果，直到全部扫描完成
+        """
+        try:
+            while True:
+                with self.lock:
+                    finished = self.pending == 0
+                if finished:
+                    # 结果在 pending 减少之前放入队列，这时已经全部在队列中
+                    while True:
+                        try:
+                            result = self.results.get_nowait()
+                        except queue.Empty:
+                            return
+                        if result is not None:
+                            yield result
+                result = self.results.get()
+                if result is not None:
+                    yield result
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(cancel_futures=True)
+
+
+def scan(
+    sources: list[Source], workers: int = 4
+) -> Iterator[tuple[str, list["tagfile.ListFile"]]]:
+    return Scanner(workers).scan(sources)
+
+
+def known_dirs() -> tuple[dict[str, float], dict[str, list[str]]]:
+    """
+    从文件表读取上次扫描的目录，返回 (目录修改时间, 子目录)
+    """
+    dir_mtimes: dict[str, float] = {}
+    subdirs: dict[str, list[str]] = {}
+    for path, name, mtime in File.list_dirs():
+        dir_mtimes[path + name + "/"] = mtime
+        subdirs.setdefault(path, []).append(name)
+    return dir_mtimes, subdirs
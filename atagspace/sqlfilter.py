@@ -0,0 +1,103 @@
+from typing import Any
+import glob
+
+from . import tagfile  # circular!
+
+
+class Untranslatable(Exception):
+    """条件无法转换为 SQL，需要在 Python 中过滤"""
+
+
+def compile_expression(
+    expression: "tagfile.OrConditions",
+) -> tuple[str, list[Any]]:
+    """
+    把 arglist 返回的表达式转换为 file 表的 WHERE 条件和参数
+
+    结果和 tagfile.apply_filter 一致，无法转换时抛出 Untranslatable
+    """
+    params: list[Any] = []
+    return _or_group(expression, params), params
+
+
+def _or_group(expression: "tagfile.OrConditions", params: list[Any]) -> str:
+    if len(expression) == 0:
+        return "0"
+    return "(" + " OR ".join(_and_group(x, params) for x in expression) + ")"
+
+
+def _and_group(conditions: "tagfile.AndConditions", params: list[Any]) -> str:
+    if len(conditions) == 0:
+        return "1"
+    return "(" + " AND ".join(_condition(x, params) for x in conditions) + ")"
+
+
+def _fts(column: str, texts: list[str], params: list[Any]) -> str:
+    """
+    用 file_fts 预先筛选 column 中包含所有 texts 的记录，之后仍然需要精确匹配
+
+    trigram 只能查找至少 3 个字符的文本，没有这样的文本时返回空字符串
+    """
+    phrases = ['"' + x.replace('"', '""') + '"' for x in texts if len(x) >= 3]
+    if not phrases:
+        return ""
+    params.append(f"{column} : ({' AND '.join(phrases)})")
+    return "file.id IN (SELECT rowid FROM file_fts WHERE file_fts MATCH ?) AND "
+
+
+def _condition(
+    cond: "tagfile.Condition", params: list[Any], disable_sym: bool = False
+) -> str:
+    if isinstance(cond, list):
+        return _or_group(cond, params)
+    arg = cond
+    if arg == "":
+        raise Untranslatable(arg)
+
+    if arg[0] == arg[-1] == '"':
+        return _condition(arg[1:-1], params, True)
+
+    if disable_sym:
+        if "*" in arg or "?" in arg or ("[" in arg and "]" in arg):
+            # 通配符之间的文本（[ 之后的部分不使用）一定出现在匹配的名称中
+            literals = arg.split("[")[0].replace("?", "*").split("*")
+            if "/" in arg:
+                where = _fts("fullpath", literals, params)
+                params.append(glob.translate(arg, recursive=True, include_hidden=True))
+                return where + "glob_match(?, file.path || file.name)"
+            else:
+                where = _fts("name", literals, params)
+                params.append(glob.translate(arg, recursive=True, include_hidden=True))
+                return where + "glob_match(?, file.name)"
+        else:
+            where = _fts("name", [arg], params)
+            params.append(arg.lower())
+            return where + "instr(py_lower(file.name), ?) > 0"
+    else:
+        if arg[0] in "+-" and arg[1:] == "":
+            # 空标签需要匹配 tags 中的空字符串，file_tag 中没有记录
+            raise Untranslatable(arg)
+        if arg[0] == "+":
+            params.append(arg[1:])
+            return (
+                "EXISTS (SELECT 1 FROM file_tag"
+                " WHERE file_tag.file_id = file.id AND file_tag.tag = ?)"
+            )
+        elif arg[0] == "-":
+            params.append(arg[1:])
+            return (
+                "NOT EXISTS (SELECT 1 FROM file_tag"
+                " WHERE file_tag.file_id = file.id AND file_tag.tag = ?)"
+            )
+        elif arg[0] == "~":
+            params.append(arg[1:])
+            return (
+                "EXISTS (SELECT 1 FROM file_tag"
+                " JOIN tag ON tag.name = file_tag.tag"
+                " JOIN category ON category.id = tag.cate_id"
+                " WHERE file_tag.file_id = file.id AND category.name = ?)"
+            )
+        elif arg[0] == "!":
+            return "NOT (" + _condition(arg[1:], params, True) + ")"
+        else:
+            return _condition(arg, params, True)
@@ -1,19 +1,18 @@
-from typing import TypeAlias
+from typing import Any, Callable, Iterator, TypeAlias
 from pathlib import Path
 from dataclasses import dataclass
-import time
 import re
 import glob
+import itertools
 import logging
 
-from .db import File, Source, sqlite_db
-from . import checker
+from .db import File, Source, batch
+from . import scanner
+from . import reconcile
 from . import category
+from . import sqlfilter
 from .constants import TAG_TODO, TAG_AS_FILE
-
-from alive_progress import alive_bar, config_handler
-
-config_handler.set_global(enrich_print=False, dual_line=True, length=10)  # type: ignore
+from .progress import alive_bar
 
 log = logging.getLogger(__name__)
 
@@ -57,7 +56,12 @@ OrConditions = list[AndConditions]  # ...|...|...
 Expression = OrConditions
 
 
-def arglist(x: str) -> Expression:
+def arglist(x: str) -> "Filter":
+    """解析表达式字符串，返回编译后的过滤条件"""
+    return Filter(parse_arglist(x))
+
+
+def parse_arglist(x: str) -> Expression:
     """解析表达式字符串，返回结构化的Expression
 
     返回格式: list[list] - 外层list代表OrConditions，内层list代表AndConditions
@@ -144,154 +148,259 @@ def arglist(x: str) -> Expression:
     return expression
 
 
-def evaluate_condition(
-    cond: Condition, file: File
-) -> tuple[bool, dict[str, list[str]]]:
-    """
-    评估单个条件
+# 匹配函数，不匹配时返回 None，匹配时返回匹配的组
+Matcher: TypeAlias = Callable[[File, list[str]], "dict[str, list[str]] | None"]
 
-    参数:
-    - cond: 条件，可以是字符串或嵌套表达式
-    - file: 要过滤的文件对象
-
-    返回:
-    - tuple[bool, dict[str, list[str]]]: (是否匹配成功, 匹配的组)
-    """
-    # 如果是嵌套表达式（列表），调用evaluate_or_group
-    if isinstance(cond, list):
-        return evaluate_or_group(cond, file)
-    # 否则是字符串条件，调用test_filter
-    else:
-        group_match: dict[str, list[str]] = {}
-        result = test_filter(cond, file, group_match=group_match)
-        return result, group_match
+# 没有匹配的组时返回的共用字典，不可修改
+_NO_GROUP: dict[str, list[str]] = {}
 
 
-def evaluate_and_group(
-    conditions: AndConditions, file: File
-) -> tuple[bool, dict[str, list[str]]]:
+class Filter:
     """
-    评估AND条件组（所有条件必须满足）
-
-    参数:
-    - conditions: AND条件组
-    - file: 要过滤的文件对象
+    编译后的过滤条件
 
-    返回:
-    - tuple[bool, dict[str, list[str]]]: (是否匹配成功, 匹配的组)
+    创建时把 Expression 中的每个条件转换为闭包（glob 预先编译为正则表达式），
+    匹配时每个文件只拆分一次标签。
     """
-    group_match: dict[str, list[str]] = {}
 
-    for cond in conditions:
-        result, sub_match = evaluate_condition(cond, file)
-        if not result:
-            return False, {}
-        # 合并group_match
-        for group, tags in sub_match.items():
-            if group not in group_match:
-                group_match[group] = []
-            group_match[group].extend(tags)
+    def __init__(self, expression: Expression) -> None:
+        self.expression = expression
+        self.tag_index = category.tag_index()
+        self.matcher = self.compile_or(expression)
 
-    return True, group_match
+    def match(self, file: File) -> tuple[bool, dict[str, list[str]]]:
+        group_match = self.matcher(file, file.tags.split(" "))
+        if group_match is None:
+            return False, {}
+        if group_match is _NO_GROUP:
+            return True, {}
+        return True, group_match
+
+    def compile_or(self, expression: OrConditions) -> Matcher:
+        matchers = [self.compile_and(x) for x in expression]
+
+        def match_or(file: File, tags: list[str]) -> dict[str, list[str]] | None:
+            for matcher in matchers:
+                group_match = matcher(file, tags)
+                if group_match is not None:
+                    return group_match
+            return None
+
+        return match_or
+
+    def compile_and(self, conditions: AndConditions) -> Matcher:
+        matchers = [self.compile_condition(x) for x in conditions]
+
+        def match_and(file: File, tags: list[str]) -> dict[str, list[str]] | None:
+            group_match = _NO_GROUP
+            for matcher in matchers:
+                sub_match = matcher(file, tags)
+                if sub_match is None:
+                    return None
+                if sub_match:
+                    if group_match is _NO_GROUP:
+                        group_match = {}
+                    for group, group_tags in sub_match.items():
+                        group_match.setdefault(group, []).extend(group_tags)
+            return group_match
+
+        return match_and
+
+    def compile_condition(self, cond: Condition, disable_sym: bool = False) -> Matcher:
+        if isinstance(cond, list):
+            return self.compile_or(cond)
+        arg = cond
+
+        if arg[0] == arg[-1] == '"':
+            return self.compile_condition(arg[1:-1], True)
+
+        if disable_sym:
+            if "*" in arg or "?" in arg or ("[" in arg and "]" in arg):
+                regex = re.compile(
+                    glob.translate(arg, recursive=True, include_hidden=True),
+                    re.IGNORECASE,
+                )
+                if "/" in arg:
+                    return lambda file, tags: (
+                        _NO_GROUP if regex.match(file.path + file.name) else None
+                    )
+                else:
+                    return lambda file, tags: (
+                        _NO_GROUP if regex.match(file.name) else None
+                    )
+            else:
+                needle = arg.lower()
+                return lambda file, tags: (
+                    _NO_GROUP if needle in file.name.lower() else None
+                )
+        else:
+            if arg[0] == "+":
+                tag = arg[1:]
+                return lambda file, tags: _NO_GROUP if tag in tags else None
+            elif arg[0] == "-":
+                tag = arg[1:]
+                return lambda file, tags: _NO_GROUP if tag not in tags else None
+            elif arg[0] == "~":
+                cate = arg[1:]
+                tag_category = self.tag_index.tag_category
+
+                def match_cate(
+                    file: File, tags: list[str]
+                ) -> dict[str, list[str]] | None:
+                    for tag in tags:
+                        if tag_category.get(tag) == cate:
+                            return {cate: [tag]}
+                    return None
+
+                return match_cate
+            elif arg[0] == "!":
+                matcher = self.compile_condition(arg[1:], True)
+                return lambda file, tags: (
+                    _NO_GROUP if matcher(file, tags) is None else None
+                )
+            else:
+                return self.compile_condition(arg, True)
 
 
-def evaluate_or_group(
-    expression: OrConditions, file: File
-) -> tuple[bool, dict[str, list[str]]]:
+def apply_filter(filter_: Filter, file: File) -> tuple[bool, dict[str, list[str]]]:
     """
-    评估OR条件组（任一AND条件组满足即可）
-
-    参数:
-    - expression: OR条件组
-    - file: 要过滤的文件对象
-
-    返回:
-    - tuple[bool, dict[str, list[str]]]: (是否匹配成功, 匹配的组)
+    测试文件是否满足过滤条件，返回 (是否匹配成功, 匹配的组)
     """
-    for and_group in expression:
-        result, group_match = evaluate_and_group(and_group, file)
-        if result:
-            return True, group_match
+    return filter_.match(file)
 
-    return False, {}
 
+def has_normal_tag(tags: str) -> bool:
+    return TAG_TODO not in tags.split(" ") and TAG_AS_FILE not in tags.split(" ")
 
-# 将apply_filter设置为evaluate_or_group的别名
-apply_filter = evaluate_or_group
+
+def list_file(
+    path: str,
+    filter_: Filter | None = None,
+    recurse: bool = False,
+    limit: int = 1000,
+    after: str | None = None,
+) -> list[File]:
+    """
+    列出文件，after 为上一页最后一个文件的路径，用于分页
+    """
+    return list(iter_file(path, filter_, recurse, limit, after))
 
 
-def test_filter(
-    arg: str,
-    file: File,
-    disable_sym: bool = False,
-    group_match: dict[str, list[str]] | None = None,
-) -> bool:
+def iter_file(
+    path: str,
+    filter_: Filter | None = None,
+    recurse: bool = False,
+    limit: int = 1000,
+    after: str | None = None,
+) -> Iterator[File]:
+    """
+    和 list_file 相同，但逐个返回文件，不在内存中保存整个结果
     """
-    测试单个条件是否满足
+    path = path_normalize(path)
+    where, params = "1", []
+    if filter_ is not None:
+        try:
+            where, params = sqlfilter.compile_expression(filter_.expression)
+            filter_ = None
+        except sqlfilter.Untranslatable as err:
+            log.debug(f"Filter in python: {err}")
+    if not recurse:
+        it = File.iter(path, where, params, path_split(after)[1] if after else None)
+        if filter_ is not None:
+            it = (file for file in it if apply_filter(filter_, file)[0])
+        yield from it
+        return
+    # 过滤条件都转换为 SQL 时，数量限制也交给 SQLite
+    sql_limit = limit if filter_ is None and limit > 0 else -1
+    it = File.iter_recurse(
+        path, where, params, sql_limit, path_split(after) if after else None
+    )
+    if filter_ is not None:
+        it = (file for file in it if apply_filter(filter_, file)[0])
+    if limit > 0:
+        yield from itertools.islice(it, limit)
+    elif limit == 0:
+        yield from it
+    else:
+        yield from list(it)[:limit]
 
-    参数:
-    - arg: 条件字符串
-    - file: 要测试的文件对象
-    - disable_sym: 是否禁用特殊符号处理
-    - group_match: 用于收集匹配的分类标签
 
-    返回:
-    - bool: 条件是否满足
+class FileTree:
     """
-    if group_match is None:
-        group_match = {}
+    用一次查询读取整个子树，按所在目录分组，用于扩展命令遍历目录
 
-    if arg[0] == arg[-1] == '"':
-        return test_filter(arg[1:-1], file, True, group_match)
+    读取之后对文件表的修改不会反映在树中。
+    """
 
-    if disable_sym:
-        if "*" in arg or "?" in arg or ("[" in arg and "]" in arg):
-            regex = glob.translate(arg, recursive=True, include_hidden=True)
-            if "/" in arg:
-                return re.match(regex, file.path + file.name, re.IGNORECASE) is not None
-            else:
-                return re.match(regex, file.name, re.IGNORECASE) is not None
-        else:
-            return arg.lower() in file.name.lower()
-    else:
-        if arg[0] == "+":
-            return arg[1:] in file.tags.split(" ")
-        elif arg[0] == "-":
-            return arg[1:] not in file.tags.split(" ")
-        elif arg[0] == "~":
-            # in cate
-            for tag in file.tags.split(" "):
-                if category.get_category_name(tag) == arg[1:]:
-                    group_match.setdefault(arg[1:], []).append(tag)
-                    return True
-            return False
-        elif arg[0] == "!":
-            return not test_filter(arg[1:], file, True, group_match)
-        else:
-            return test_filter(arg, file, True, group_match)
+    def __init__(self, path: str) -> None:
+        self.children: dict[str, list[File]] = {}
+        for file in File.iter_recurse(path_normalize(path)):
+            self.children.setdefault(file.path, []).append(file)
 
+    def list(self, path: str) -> list[File]:
+        """目录中的文件，按名称排列，和 list_file(path) 相同但没有数量限制"""
+        path = path_normalize(path)
+        if path[-1] != "/":
+            path += "/"
+        return self.children.get(path, [])
 
-def has_normal_tag(tags: str) -> bool:
-    return TAG_TODO not in tags.split(" ") and TAG_AS_FILE not in tags.split(" ")
 
+def facets(
+    path: str, filter_: Filter | None = None, recurse: bool = False
+) -> dict[str, Any]:
+    """
+    统计列出的文件中每个标签和每个分类的文件数和总大小（不包括目录的大小）
 
-def list_file(
-    path: str,
-    filter_: OrConditions | None = None,
-    recurse: bool = False,
-    limit: int = 1000,
-) -> list[File]:
+    返回 {"count": 文件数, "size": 总大小, "tags": {标签: {"count", "size"}},
+    "categories": {分类: {"count", "size"}}}
+    """
     path = path_normalize(path)
-    if recurse:
-        files = File.list_recurse(path)
-    else:
-        files = File.list(path)
+    result: dict[str, Any] = {"count": 0, "size": 0, "tags": {}, "categories": {}}
+    where, params = "1", []
     if filter_ is not None:
-        files = [file for file in files if apply_filter(filter_, file)[0]]
-    if not recurse or limit == 0:
-        return files
-    files = files[:limit]
-    return files
+        try:
+            where, params = sqlfilter.compile_expression(filter_.expression)
+            filter_ = None
+        except sqlfilter.Untranslatable as err:
+            log.debug(f"Filter in python: {err}")
+    if filter_ is None:
+        facet = [None, result["tags"], result["categories"]]
+        for kind, name, count, size in File.facets(path, recurse, where, params):
+            if kind == 0:
+                result["count"], result["size"] = count, size
+            else:
+                facet[kind][name] = {"count": count, "size": size}
+        return result
+
+    # 过滤条件需要在 Python 中计算时，逐个累加
+    index = category.tag_index()
+
+    def add(facet: dict[str, Any], name: str, size: int) -> None:
+        item = facet.setdefault(name, {"count": 0, "size": 0})
+        item["count"] += 1
+        item["size"] += size
+
+    for file in iter_file(path, filter_, recurse, 0):
+        size = 0 if file.is_dir else file.size
+        result["count"] += 1
+        result["size"] += size
+        tags = {tag for tag in file.tags.split(" ") if tag != ""}
+        cates: set[str] = set()
+        for tag in tags:
+            add(result["tags"], tag, size)
+            cate = index.get_category_name(tag)
+            if cate is not None:
+                cates.add(cate)
+        for cate in cates:
+            add(result["categories"], cate, size)
+    return result
+
+
+def path_split(path: str) -> tuple[str, str]:
+    """把完整路径拆分为文件表中的 (path, name)"""
+    path = path_normalize(path)
+    i = path.rindex("/")
+    return path[: i + 1], path[i + 1 :]
 
 
 def create_file(file: ListFile, checksum: str | None, tags: str = TAG_TODO) -> None:
@@ -308,20 +417,6 @@ def create_file(file: ListFile, checksum: str | None, tags: str = TAG_TODO) -> N
     )
 
 
-def update_file_listfile(
-    file: File, listfile: ListFile | File, checksum: str | None
-) -> None:
-    file.path = listfile.path
-    file.name = listfile.name
-    file.size = listfile.size
-    file.mtime = listfile.mtime
-    file.dev = listfile.dev
-    file.ino = listfile.ino
-    file.is_dir = listfile.is_dir
-    file.checksum = checksum
-    file.self_update()
-
-
 def i64(x: int) -> int:
     x = x & 0xFFFFFFFFFFFFFFFF
     if x >= 0x8000000000000000:
@@ -355,169 +450,35 @@ def move_file(id_: int, path: str | None, name: str | None) -> None:
     File.set_path_name(id_, path, name)
 
 
-def update_new(full: bool = False) -> None:
+def update_new(
+    full: bool = False,
+    scan_workers: int = 4,
+    hash_workers: int = 4,
+    incremental: bool = False,
+) -> None:
     filelist: list[ListFile] = []
 
+    if incremental:
+        dir_mtimes, subdirs = scanner.known_dirs()
+        scan = scanner.Scanner(scan_workers, dir_mtimes, subdirs)
+    else:
+        scan = scanner.Scanner(scan_workers)
     with alive_bar(title="List") as bar:
-
-        def perfile(path: str, f: Path, is_dir: bool) -> None:
-            try:
-                stat = f.lstat()
-                filelist.append(
-                    ListFile(
-                        path=path,
-                        name=f.name,
-                        size=stat.st_size,
-                        mtime=stat.st_mtime,
-                        dev=i64(stat.st_dev),
-                        ino=i64(stat.st_ino),
-                        is_dir=is_dir,
-                    )
-                )
-            except Exception as err:
-                log.error(f"Error stat {path}: {err}")
-            bar()
-
-        for source in Source.list():
-            root = Path(source.path)
-            filelist.append(
-                ListFile(
-                    path="/",
-                    name=source.name,
-                    size=0,
-                    mtime=time.time(),
-                    dev=0,
-                    ino=0,
-                    is_dir=True,
-                )
-            )
-            bar()
-            for p, ds, fs in root.walk():
-                rela = p.relative_to(root)
-                path = (
-                    "/" + source.name + "/" + "".join(part + "/" for part in rela.parts)
-                )
-                bar.text(path)
-                # filter ".xx's"
-                ds[:] = [dn for dn in ds if dn[0] != "."]
-                fs[:] = [fn for fn in fs if fn[0] != "."]
-                for dn in ds:
-                    perfile(path, p / dn, True)
-                for fn in fs:
-                    perfile(path, p / fn, False)
-
-    tocheck: list[ListFile | File] = []
-    newcheck: list[ListFile] = []
-
-    filelist2: list[ListFile] = []
-    # 这里设置事务锁住是为了防止看到只更新一半的文件
-    with sqlite_db:
-        File.mark_all_delete()
-        # 文件已经记录(path+name)？更新记录
-        with alive_bar(len(filelist), title="Update") as bar:
-            for file in filelist:
-                # bar.text(file.path + file.name)
-                existing = File.reuse_get_path_name(file.path, file.name)
-                if existing is not None:
-                    checksum = checker.check(file, cache_only=True)
-                    update_file_listfile(existing, file, checksum)
-                    if not existing.is_dir and existing.checksum is None:
-                        if full or has_normal_tag(existing.tags):
-                            tocheck.append(existing)
-                else:
-                    filelist2.append(file)
-                bar()
-
-    # 否则，查找相同的文件(dev+ino)
-    filelist = filelist2
-    filelist2 = []
-    with alive_bar(len(filelist), title="Inode") as bar:
-        for file in filelist:
-            # bar.text(file.path + file.name)
-            existing = None
-            if file.dev is not None and file.ino is not None:
-                existing = File.reuse_get_dev_ino(file.dev, file.ino)
-            if existing is not None:
-                checksum = checker.check(file, cache_only=True)
-                if existing.deltime is None:
-                    log.info(f"Copy: {existing.path}{existing.name}")
-                    log.info(f"   -> {file.path}{file.name}")
-                    create_file(file, checksum, tags=existing.tags)
-                else:
-                    log.info(f"Move: {existing.path}{existing.name}")
-                    log.info(f"   -> {file.path}{file.name}")
-                    update_file_listfile(existing, file, checksum)
-                if not existing.is_dir and existing.checksum is None:
-                    if full or existing.tags:
-                        tocheck.append(existing)
-            else:
-                if file.is_dir:
-                    create_file(file, None)
-                else:
-                    filelist2.append(file)
-            bar()
-
-    # 否则，查找相同的文件(size+checksum)
-    filelist = filelist2
-    with alive_bar(len(filelist), title="Size") as bar:
-        for file in filelist:
-            # bar.text(file.path + file.name)
-            existings = File.reuse_list_size(file.size, full)
-            checksum = checker.check(file, cache_only=True)
-            if len(existings) > 0 or full:
-                if checksum is None:
-                    newcheck.append(file)
-                else:
-                    existing = next(
-                        (x for x in existings if x.checksum == checksum), None
-                    )
-                    if existing is not None:
-                        if existing.deltime is None:
-                            log.info(f"Copy: {existing.path}{existing.name}")
-                            log.info(f"   -> {file.path}{file.name}")
-                            create_file(file, checksum, tags=existing.tags)
-                        else:
-                            log.info(f"Move: {existing.path}{existing.name}")
-                            log.info(f"   -> {file.path}{file.name}")
-                            update_file_listfile(existing, file, checksum)
-                    else:
-                        create_file(file, checksum)
-            else:
-                create_file(file, checksum)
-            bar()
-
-    with alive_bar(
-        sum(x.size for x in tocheck) + sum(x.size for x in newcheck),
-        title="Sha256",
-        unit="B",
-        scale="SI",
-    ) as bar:
-        for file in tocheck:
-            bar.text(file.path + file.name)
-            existing = File.reuse_get_path_name(file.path, file.name)
-            assert existing is not None
-            checksum = checker.check(file)
-            update_file_listfile(existing, file, checksum)
-            bar(file.size)
-        for file in newcheck:
-            bar.text(file.path + file.name)
-            existing = None
-            checksum = checker.check(file)
-            if checksum is None:
-                continue
-            existing = File.reuse_get_size_checksum(file.size, checksum)
-            if existing is not None:
-                if existing.deltime is None:
-                    log.info(f"Copy: {existing.path}{existing.name}")
-                    log.info(f"   -> {file.path}{file.name}")
-                    create_file(file, checksum, tags=existing.tags)
-                else:
-                    log.info(f"Move: {existing.path}{existing.name}")
-                    log.info(f"   -> {file.path}{file.name}")
-                    update_file_listfile(existing, file, checksum)
-            else:
-                create_file(file, checksum)
-            bar(file.size)
+        for path, files in scan.scan(Source.list()):
+            bar.text(path)
+            filelist.extend(files)
+            bar(len(files))
+    # 并行扫描的结果顺序不固定，排序以保证复制/移动的判断顺序一致
+    filelist.sort(key=lambda file: (file.path, file.name))
+
+    # 写入数据库的操作批量提交
+    with batch():
+        index = reconcile.FileIndex.load()
+        # 没有变化的目录中的文件没有重新列出，直接保留，还没有校验和的仍然需要计算
+        carried: list[File] = []
+        for path in scan.carried:
+            carried.extend(index.keep(path, full))
+        reconcile.reconcile(filelist, index, full, hash_workers, carried=carried)
 
 
 def update_src(path: str) -> None:
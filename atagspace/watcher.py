@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+import os
+import stat
+import logging
+
+import watchfiles
+
+from .db import File, Source, batch
+from . import scanner
+from . import reconcile
+from . import tagfile  # circular!
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Target:
+    """一个发生变化的路径"""
+
+    realpath: str
+    path: str
+    name: str
+    added: bool
+
+
+class Watcher:
+    """
+    监视文件源的变化，更新文件表
+
+    watchfiles 把一段时间内的事件合并成一批，每批事件在一个事务中处理：
+    先把消失的路径标记为删除，再把出现或修改的路径（和新目录中的文件）交给
+    reconcile 对照，移动和重命名通过 dev+ino 或校验和识别，标签跟随文件。
+    """
+
+    def __init__(
+        self, sources: list[Source], scan_workers: int = 4, hash_workers: int = 4
+    ) -> None:
+        self.scan_workers = scan_workers
+        self.hash_workers = hash_workers
+        # 较长的路径在前，嵌套的文件源优先匹配内层
+        self.roots = sorted(
+            ((os.path.abspath(source.path), source.name) for source in sources),
+            key=lambda x: len(x[0]),
+            reverse=True,
+        )
+
+    def translate(self, realpath: str) -> tuple[str, str] | None:
+        """
+        把实际路径转换为文件表中的 (path, name)，不在文件源中或者是隐藏文件时返回 None
+        """
+        realpath = os.path.abspath(realpath)
+        for root, name in self.roots:
+            if realpath == root:
+                return None
+            if realpath.startswith(root.rstrip(os.sep) + os.sep):
+                parts = os.path.relpath(realpath, root).split(os.sep)
+                # filter ".xx's"
+                if any(part.startswith(".") for part in parts):
+                    return None
+                return "/" + "/".join([name, *parts[:-1]]) + "/", parts[-1]
+        return None
+
+    def stat(self, target: Target) -> "tagfile.ListFile | None":
+        try:
+            st = os.lstat(target.realpath)
+        except FileNotFoundError:
+            return None
+        return tagfile.ListFile(
+            path=target.path,
+            name=target.name,
+            size=st.st_size,
+            mtime=st.st_mtime,
+            dev=tagfile.i64(st.st_dev),
+            ino=tagfile.i64(st.st_ino),
+            is_dir=stat.S_ISDIR(st.st_mode),
+        )
+
+    def collect(self, changes: set[tuple[watchfiles.Change, str]]) -> dict[str, Target]:
+        targets: dict[str, Target] = {}
+
+        def add(realpath: str, added: bool) -> None:
+            translated = self.translate(realpath)
+            if translated is None:
+                return
+            path, name = translated
+            target = targets.get(path + name)
+            if target is None:
+                targets[path + name] = Target(realpath, path, name, added)
+            else:
+                target.added = target.added or added
+
+        for change, realpath in changes:
+            add(realpath, change == watchfiles.Change.added)
+            # 目录内容变化时目录的修改时间也会变化，一起更新
+            add(os.path.dirname(os.path.abspath(realpath)), False)
+        return targets
+
+    def apply(self, changes: set[tuple[watchfiles.Change, str]]) -> None:
+        targets = self.collect(changes)
+        filelist: list[tagfile.ListFile] = []
+        scan = scanner.Scanner(self.scan_workers)
+        with batch():
+            for target in targets.values():
+                try:
+                    file = self.stat(target)
+                except Exception as err:
+                    log.error(f"Error stat {target.path}{target.name}: {err}")
+                    continue
+                if file is None:
+                    log.info(f"Delete: {target.path}{target.name}")
+                    File.mark_delete(target.path, target.name)
+                    continue
+                filelist.append(file)
+                # 新出现的目录（例如移动进来的目录）需要扫描其中的文件
+                if file.is_dir and target.added:
+                    scan.submit(
+                        file.dev,
+                        target.realpath,
+                        file.path + file.name + "/",
+                        file.mtime,
+                    )
+            for _, files in scan.run():
+                filelist.extend(files)
+            # 新目录中的文件可能也有单独的事件，去掉重复的
+            unique = {(file.path, file.name): file for file in filelist}
+            reconcile.reconcile(
+                [unique[key] for key in sorted(unique)],
+                reconcile.FileTable(),
+                hash_workers=self.hash_workers,
+                quiet=True,
+            )
+
+    def watch(self, debounce: int = 1600) -> None:
+        paths = [root for root, _ in self.roots]
+        log.info(f"Watching {len(paths)} sources")
+        for changes in watchfiles.watch(
+            *paths, watch_filter=None, debounce=debounce, raise_interrupt=False
+        ):
+            log.info(f"{len(changes)} changes")
+            self.apply(changes)
+
+
+def watch(debounce: int = 1600, scan_workers: int = 4, hash_workers: int = 4) -> None:
+    # 启动前的变化不会产生事件，先增量刷新一次
+    tagfile.update_new(
+        scan_workers=scan_workers, hash_workers=hash_workers, incremental=True
+    )
+    Watcher(Source.list(), scan_workers, hash_workers).watch(debounce)
@@ -1,14 +1,22 @@
-from typing import Callable, Any, Awaitable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Awaitable, Iterator
 import os
 import json
+import asyncio
+import logging
+import threading
+import time
 from dataclasses import is_dataclass, asdict as dataclass_asdict
 
 
 from aiohttp import web
 
+from . import db
 from . import tagfile
 from . import category
 
+log = logging.getLogger(__name__)
+
 
 def json_default(x: Any) -> Any:
     if is_dataclass(x):
@@ -23,100 +31,259 @@ def json_dumps(x: Any) -> str:
     )
 
 
+# 数据库和文件操作在线程池中执行，不阻塞事件循环：
+# 读操作使用多个只读连接并发执行，写操作使用一个连接依次执行。
+# 流式响应在整个发送过程中占用一个线程，使用单独的线程池，不占用读线程池
+READ_WORKERS = 4
+STREAM_WORKERS = 2
+read_pool_key = web.AppKey("read_pool", ThreadPoolExecutor)
+stream_pool_key = web.AppKey("stream_pool", ThreadPoolExecutor)
+write_pool_key = web.AppKey("write_pool", ThreadPoolExecutor)
+# 线程池中各线程打开的连接，线程池结束后关闭
+connections_key = web.AppKey("connections", list)
+
+
+def bind_connection(connections: list[Any], readonly: bool) -> None:
+    connection = db.connect(readonly=readonly, check_same_thread=False)
+    connections.append(connection)
+    db.bind(connection)
+
+
+async def start_pools(app: web.Application) -> None:
+    connections: list[Any] = []
+    app[connections_key] = connections
+    app[read_pool_key] = ThreadPoolExecutor(
+        READ_WORKERS,
+        "web-read",
+        initializer=bind_connection,
+        initargs=(connections, True),
+    )
+    app[stream_pool_key] = ThreadPoolExecutor(
+        STREAM_WORKERS,
+        "web-stream",
+        initializer=bind_connection,
+        initargs=(connections, True),
+    )
+    app[write_pool_key] = ThreadPoolExecutor(
+        1, "web-write", initializer=bind_connection, initargs=(connections, False)
+    )
+
+
+async def stop_pools(app: web.Application) -> None:
+    pools = [app[read_pool_key], app[stream_pool_key], app[write_pool_key]]
+
+    def shutdown() -> None:
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+        # 线程都已经结束，可以在这里关闭它们的连接
+        for connection in app[connections_key]:
+            connection.close()
+
+    await asyncio.to_thread(shutdown)
+
+
+# 流式响应每次发送的大小
+STREAM_CHUNK = 65536
+# 已有结果时最多等待的秒数，查询返回结果较慢时也能尽快显示
+STREAM_INTERVAL = 0.1
+# 最多缓存的未发送块数，客户端接收较慢时查询也会暂停
+STREAM_BUFFER = 4
+
+
+async def ndjson_response(
+    req: web.Request, pool: ThreadPoolExecutor, rows: Iterator[Any]
+) -> web.StreamResponse:
+    """
+    以 NDJSON（每行一个 JSON）逐步发送结果，不在内存中保存整个结果
+
+    rows 在线程池的一个线程中读取（数据库连接只能在所属的线程使用），
+    第一行立即发送，之后每凑够 STREAM_CHUNK 字节或者距离上次发送超过
+    STREAM_INTERVAL 秒时交给事件循环发送。读取出错时响应已经开始，
+    不能再改变状态码，最后一行发送 {"error": ...}。
+    """
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await resp.prepare(req)
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue[bytes | None] = asyncio.Queue()
+    slots = threading.Semaphore(STREAM_BUFFER)
+    stopped = threading.Event()
+
+    def send(chunk: bytes) -> bool:
+        while not slots.acquire(timeout=1):
+            if stopped.is_set():
+                return False
+        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        return True
+
+    def produce() -> None:
+        try:
+            lines: list[str] = []
+            size = 0
+            deadline = 0.0
+            try:
+                for row in rows:
+                    line = json_dumps(row) + "\n"
+                    lines.append(line)
+                    size += len(line)
+                    if size >= STREAM_CHUNK or time.monotonic() >= deadline:
+                        if not send("".join(lines).encode("utf-8")):
+                            return
+                        lines = []
+                        size = 0
+                        deadline = time.monotonic() + STREAM_INTERVAL
+            except Exception as err:
+                log.exception(f"Stream failed: {req.path}")
+                lines.append(json_dumps({"error": str(err)}) + "\n")
+            if lines:
+                send("".join(lines).encode("utf-8"))
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+    future = loop.run_in_executor(pool, produce)
+    try:
+        while (chunk := await chunks.get()) is not None:
+            slots.release()
+            await resp.write(chunk)
+    finally:
+        stopped.set()
+    await future
+    await resp.write_eof()
+    return resp
+
+
 # TODO api.py
 def webjson(
-    fn: Callable[..., Awaitable[Any]],
-) -> Callable[[web.Request], Awaitable[web.Response]]:
-    async def handle(req: web.Request) -> web.Response:
+    fn: Callable[..., Any], write: bool = False
+) -> Callable[[web.Request], Awaitable[web.StreamResponse]]:
+    """
+    把同步函数包装为 JSON API，函数在读线程池（write 时在写线程池）中执行
+    """
+
+    def call(j: Any) -> Any:
+        r = fn(**j)
+        if isinstance(r, Iterator):
+            return r
+        return json_dumps(r)
+
+    async def handle(req: web.Request) -> web.StreamResponse:
         path = await req.content.read()
         j = json.loads(path.decode("utf-8"))
-        r = await fn(**j)
-        return web.json_response(r, dumps=json_dumps)
+        pool = req.app[write_pool_key if write else read_pool_key]
+        r = await asyncio.get_running_loop().run_in_executor(pool, call, j)
+        if isinstance(r, Iterator):
+            # 迭代器在第一次读取时才使用数据库连接，可以交给流式线程池
+            if not write:
+                pool = req.app[stream_pool_key]
+            return await ndjson_response(req, pool, r)
+        return web.Response(text=r, content_type="application/json")
 
     return handle
 
 
+def webjson_write(
+    fn: Callable[..., Any],
+) -> Callable[[web.Request], Awaitable[web.StreamResponse]]:
+    return webjson(fn, write=True)
+
+
 @webjson
-async def handle_list(
-    path: str, filter: str = "", recurse: bool = False, limit: int = 1000
+def handle_list(
+    path: str,
+    filter: str = "",
+    recurse: bool = False,
+    limit: int = 1000,
+    after: str | None = None,
+    stream: bool = False,
 ) -> Any:
-    return tagfile.list_file(path, tagfile.arglist(filter), recurse, limit)
+    if stream:
+        # 返回迭代器，以 NDJSON 流式发送
+        return tagfile.iter_file(path, tagfile.arglist(filter), recurse, limit, after)
+    return tagfile.list_file(path, tagfile.arglist(filter), recurse, limit, after)
+
+
+@webjson
+def handle_facets(path: str, filter: str = "", recurse: bool = False) -> Any:
+    return tagfile.facets(path, tagfile.arglist(filter), recurse)
 
 
 @webjson
-async def handle_category() -> Any:
+def handle_category() -> Any:
+    index = category.tag_index()
     return [
         {
             "name": cate.name,
             "color": cate.color,
             "tags": [
                 {"name": tag.name, "color": tag.color}
-                for tag in category.list_tag(cate.name)
+                for tag in index.list_tag(cate.name)
             ],
         }
-        for cate in category.list_category()
+        for cate in index.categories
     ]
 
 
-@webjson
-async def handle_set_category(name: str, color: str | None) -> Any:
+@webjson_write
+def handle_set_category(name: str, color: str | None) -> Any:
     category.set_category(name, color)
     return None
 
 
-@webjson
-async def handle_rename_category(name: str, newname: str) -> Any:
+@webjson_write
+def handle_rename_category(name: str, newname: str) -> Any:
     category.rename_category(name, newname)
     return None
 
 
-@webjson
-async def handle_remove_category(name: str) -> Any:
+@webjson_write
+def handle_remove_category(name: str) -> Any:
     category.remove_cate(name)
     return None
 
 
-@webjson
-async def handle_set_tags(tags: list[str], cate: str) -> Any:
+@webjson_write
+def handle_set_tags(tags: list[str], cate: str) -> Any:
     for tag in tags:
         category.set_tag(tag, cate)
     return None
 
 
-@webjson
-async def handle_remove_tags(tags: list[str]) -> Any:
+@webjson_write
+def handle_remove_tags(tags: list[str]) -> Any:
     for tag in tags:
         category.remove_tag(tag)
     return None
 
 
-@webjson
-async def handle_set_tags_color(tags: list[str], color: str | None) -> Any:
+@webjson_write
+def handle_set_tags_color(tags: list[str], color: str | None) -> Any:
     for tag in tags:
         category.set_tag_color(tag, color)
     return None
 
 
-@webjson
-async def handle_tag_file(ids: list[int], tags: list[str]) -> Any:
+@webjson_write
+def handle_tag_file(ids: list[int], tags: list[str]) -> Any:
     for id in ids:
         tagfile.tag_file(id, tags)
     return None
 
 
-@webjson
-async def handle_tag_change(ids: list[int], adds: list[str], removes: list[str]) -> Any:
+@webjson_write
+def handle_tag_change(ids: list[int], adds: list[str], removes: list[str]) -> Any:
     for id in ids:
         tagfile.tag_file_change(id, adds, removes)
     return None
 
 
 async def handle_get_content(req: web.Request) -> web.FileResponse:
-    return web.FileResponse(tagfile.source_translate(req.query.get("path") or ""))
+    path = await asyncio.get_running_loop().run_in_executor(
+        req.app[read_pool_key], tagfile.source_translate, req.query.get("path") or ""
+    )
+    return web.FileResponse(path)
 
 
 @webjson
-async def handle_open_content(path: str) -> None:
+def handle_open_content(path: str) -> None:
     os.startfile(tagfile.source_translate(path))
 
 
@@ -127,8 +294,11 @@ async def handle_index(req: web.Request) -> web.Response:
 
 
 app = web.Application()
+app.on_startup.append(start_pools)
+app.on_cleanup.append(stop_pools)
 app.router.add_get("/", handle_index)
 app.router.add_post("/list", handle_list)
+app.router.add_post("/facets", handle_facets)
 app.router.add_post("/category", handle_category)
 app.router.add_post("/set_category", handle_set_category)
 app.router.add_post("/rename_category", handle_rename_category)
@@ -0,0 +1,159 @@
+"""
+生成用于性能测试的文件库：文件源目录、sources 文件和 atagspace.db
+
+    python -m benchmarks.generate WORKDIR --files 10000 --depth 3
+"""
+
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any
+import random
+import shutil
+
+import typer
+
+from atagspace import db, tagfile, category
+from atagspace.constants import TAG_TODO
+
+EXTENSIONS = [".jpg", ".png", ".mp4", ".txt", ".pdf", ".md"]
+# 文件大小的范围，较小的范围会产生更多同样大小的文件
+MAX_SIZE = 4096
+
+
+@dataclass
+class LibraryConfig:
+    files: int = 10000
+    # 目录层数和每个目录中的子目录数
+    depth: int = 3
+    fanout: int = 8
+    # 有标签（而不是待分类标记）的文件比例
+    tag_density: float = 0.5
+    # 内容和另一个文件相同的文件比例
+    duplicate_ratio: float = 0.1
+    categories: int = 5
+    tags_per_category: int = 8
+    seed: int = 0
+
+
+def category_name(i: int) -> str:
+    return f"类别{i}"
+
+
+def tag_name(i: int, j: int) -> str:
+    return f"标签{i}-{j}"
+
+
+def generate_tree(root: Path, config: LibraryConfig) -> list[str]:
+    """
+    在 root 中生成目录和文件，返回文件的相对路径（按生成顺序）
+    """
+    rng = random.Random(config.seed)
+    dirs = [Path()]
+    level = [Path()]
+    for depth in range(config.depth):
+        level = [
+            parent / f"d{depth}-{i}" for parent in level for i in range(config.fanout)
+        ]
+        dirs.extend(level)
+    for d in dirs:
+        (root / d).mkdir(parents=True, exist_ok=True)
+    files: list[str] = []
+    contents: list[bytes] = []
+    for i in range(config.files):
+        if contents and rng.random() < config.duplicate_ratio:
+            content = rng.choice(contents)
+        else:
+            content = rng.randbytes(rng.randint(0, MAX_SIZE))
+            contents.append(content)
+        name = (rng.choice(dirs) / f"f{i}{rng.choice(EXTENSIONS)}").as_posix()
+        (root / name).write_bytes(content)
+        files.append(name)
+    return files
+
+
+def generate_tags(config: LibraryConfig) -> None:
+    """建立分类和标签，并按 tag_density 给文件加上标签"""
+    rng = random.Random(config.seed + 1)
+    for i in range(config.categories):
+        category.set_category(category_name(i), None)
+        for j in range(config.tags_per_category):
+            category.set_tag(tag_name(i, j), category_name(i))
+    with db.batch():
+        for file in db.File.list_all():
+            if file.deltime is not None or rng.random() >= config.tag_density:
+                continue
+            # 每个分类最多一个标签，automove 的规则才能确定目标
+            cates = rng.sample(range(config.categories), rng.randint(1, 3))
+            tags = [tag_name(i, rng.randrange(config.tags_per_category)) for i in cates]
+            db.File.set_tags(file.id, " ".join(tags))
+
+
+def open_library(workdir: Path) -> None:
+    """让当前进程使用 workdir 中的数据库"""
+    db.close()
+    db.DB_PATH = str(workdir / "atagspace.db")
+    db.init()
+
+
+def generate_library(workdir: Path, config: LibraryConfig) -> dict[str, Any]:
+    """
+    在 workdir 中生成文件源 lib/、sources.txt 和 atagspace.db，返回文件库的统计
+    """
+    if workdir.exists():
+        shutil.rmtree(workdir)
+    root = workdir / "lib"
+    root.mkdir(parents=True)
+    files = generate_tree(root, config)
+    sources = workdir / "sources.txt"
+    sources.write_text(f"L|{root.resolve()}\n", encoding="utf-8")
+    open_library(workdir)
+    tagfile.update_src(str(sources))
+    tagfile.update_new()
+    generate_tags(config)
+    tagged = db.sqlite_db.execute(
+        "SELECT count(*) FROM file WHERE NOT is_dir AND tags != ? AND tags != ''",
+        (TAG_TODO,),
+    ).fetchone()[0]
+    return {"files": len(files), "tagged": tagged, "config": asdict(config)}
+
+
+def copy_library(src: Path, dst: Path) -> None:
+    """复制生成的文件库，数据库中的文件源指向新的位置"""
+    db.close()
+    if dst.exists():
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst, symlinks=True)
+    open_library(dst)
+    db.Source.clear()
+    db.Source.add("L", str((dst / "lib").resolve()))
+
+
+def main(
+    workdir: Path = typer.Argument(..., help="输出目录（会被清空）"),
+    files: int = typer.Option(10000, "--files", help="文件数"),
+    depth: int = typer.Option(3, "--depth", help="目录层数"),
+    fanout: int = typer.Option(8, "--fanout", help="每个目录中的子目录数"),
+    tag_density: float = typer.Option(0.5, "--tag-density", help="有标签的文件比例"),
+    duplicate_ratio: float = typer.Option(
+        0.1, "--duplicate-ratio", help="重复文件比例"
+    ),
+    seed: int = typer.Option(0, "--seed", help="随机种子"),
+):
+    """生成测试用的文件库"""
+    config = LibraryConfig(
+        files=files,
+        depth=depth,
+        fanout=fanout,
+        tag_density=tag_density,
+        duplicate_ratio=duplicate_ratio,
+        seed=seed,
+    )
+    try:
+        stats = generate_library(workdir, config)
+    finally:
+        db.close()
+    typer.echo(f"生成 {stats['files']} 个文件，{stats['tagged']} 个有标签")
+
+
+if __name__ == "__main__":
+    typer.run(main)
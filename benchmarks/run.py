@@ -0,0 +1,286 @@
+"""
+性能测试：生成文件库，测量刷新、查询、扩展命令和 web /list 的耗时，以 JSON 输出
+
+    python -m benchmarks.run --files 10000 --output bench.json
+
+同样的参数和随机种子生成同样的文件库，不同版本的结果可以直接比较。
+"""
+
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import typer
+
+from atagspace import db, tagfile
+from .generate import (
+    LibraryConfig,
+    category_name,
+    copy_library,
+    generate_library,
+)
+
+# list_file 使用的过滤条件，包括可以转换为 SQL 的和需要在 Python 中计算的
+LIST_FILTERS = {
+    "all": "",
+    "tag": "+标签0-0",
+    "not_tag": "-标签0-0",
+    "category": "~类别1",
+    "substring": "f12",
+    "glob": "*.jpg",
+    "glob_path": "/L/d0-1/*",
+    "combined": "( *.jpg | *.png ) ~类别2 -标签3-1",
+    "python": "-",
+}
+
+
+class Recorder:
+    """记录每项测试的耗时"""
+
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results: list[dict[str, Any]] = []
+
+    def add(self, name: str, times: list[float], items: int, **extra: Any) -> None:
+        seconds = statistics.median(times)
+        result = {
+            "name": name,
+            "seconds": seconds,
+            "min_seconds": min(times),
+            "runs": len(times),
+            "items": items,
+            "items_per_second": items / seconds if seconds > 0 else None,
+            **extra,
+        }
+        self.results.append(result)
+        print(f"{name}: {seconds * 1000:.1f} ms ({items} items)", file=sys.stderr)
+
+    @contextmanager
+    def once(self, name: str, **extra: Any) -> Iterator[dict[str, Any]]:
+        """
+        测量只能运行一次的操作（会修改文件库），处理的数量和其他信息写入返回的字典
+        """
+        info: dict[str, Any] = {"items": 0, **extra}
+        start = time.perf_counter()
+        yield info
+        seconds = time.perf_counter() - start
+        self.add(name, [seconds], **info)
+
+    def repeated(self, name: str, fn: Any, **extra: Any) -> None:
+        """重复 repeat 次测量只读操作，fn 返回处理的数量"""
+        times = []
+        items = 0
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            items = fn()
+            times.append(time.perf_counter() - start)
+        self.add(name, times, items, **extra)
+
+
+def live_count() -> int:
+    return db.sqlite_db.execute(
+        "SELECT count(*) FROM file WHERE deltime IS NULL"
+    ).fetchone()[0]
+
+
+def bench_update(rec: Recorder, base: Path, workdir: Path) -> None:
+    # 冷启动：空的文件表
+    cold = workdir / "cold"
+    copy_library(base, cold)
+    db.sqlite_db.execute("DELETE FROM file")
+    db.sqlite_db.execute("DELETE FROM checksum")
+    db.sqlite_db.commit()
+    with rec.once("update_new.cold") as info:
+        tagfile.update_new()
+        info["items"] = live_count()
+    db.close()
+    shutil.rmtree(cold)
+
+    copy_library(base, workdir / "work")
+    count = live_count()
+    with rec.once("update_new.warm", items=count):
+        tagfile.update_new()
+    with rec.once("update_new.warm_incremental", items=count):
+        tagfile.update_new(incremental=True)
+
+    # 移动一部分文件和一个目录
+    root = workdir / "work" / "lib"
+    rng = random.Random(0)
+    files = sorted(p for p in root.rglob("*") if p.is_file())
+    moved = rng.sample(files, len(files) // 10)
+    for i, path in enumerate(moved):
+        path.rename(path.parent.parent / f"moved{i}-{path.name}")
+    (root / "d0-0").rename(root / "d0-0-moved")
+    with rec.once("update_new.moved", items=count, moved_files=len(moved)):
+        tagfile.update_new()
+    with rec.once("update_new.moved_incremental", items=count):
+        tagfile.update_new(incremental=True)
+
+
+def bench_list(rec: Recorder) -> None:
+    for name, expression in LIST_FILTERS.items():
+        filter_ = tagfile.arglist(expression)
+        rec.repeated(
+            f"list_file.{name}",
+            lambda: len(tagfile.list_file("/", filter_, True, 0)),
+            filter=expression,
+        )
+    rec.repeated(
+        "list_file.page",
+        lambda: len(tagfile.list_file("/", None, True, 1000)),
+    )
+    rec.repeated("facets.all", lambda: tagfile.facets("/", None, True)["count"])
+    rec.repeated(
+        "facets.category",
+        lambda: tagfile.facets("/", tagfile.arglist("~类别1"), True)["count"],
+    )
+
+
+def bench_web(rec: Recorder) -> None:
+    from aiohttp.test_utils import TestClient, TestServer
+    from atagspace.web import app
+
+    queries = {
+        "dir": {"path": "/L/"},
+        "find": {"path": "/", "filter": "*.jpg", "recurse": True, "limit": 0},
+        "find_stream": {
+            "path": "/",
+            "filter": "*.jpg",
+            "recurse": True,
+            "limit": 0,
+            "stream": True,
+        },
+        "facets": {"path": "/", "recurse": True},
+    }
+
+    async def run() -> None:
+        async with TestClient(TestServer(app)) as client:
+            for name, param in queries.items():
+                endpoint = "/facets" if name == "facets" else "/list"
+                times = []
+                size = 0
+                for _ in range(rec.repeat):
+                    start = time.perf_counter()
+                    resp = await client.post(endpoint, data=json.dumps(param))
+                    size = len(await resp.read())
+                    times.append(time.perf_counter() - start)
+                rec.add(f"web.{name}", times, size, unit="bytes")
+
+    asyncio.run(run())
+
+
+def bench_extensions(rec: Recorder, workdir: Path, config: LibraryConfig) -> None:
+    from atagspace.extensions import automove, sorttag, totag
+
+    count = live_count()
+    with rec.once("totag", items=count):
+        totag.totag("/")
+    with rec.once("sorttag", items=count):
+        sorttag.sorttag("/")
+
+    rules = workdir / "moverule.txt"
+    rules.write_text(
+        "".join(
+            f"~{category_name(i)} = /L/sorted/{{{category_name(i)}}}\n"
+            for i in range(config.categories)
+        ),
+        encoding="utf-8",
+    )
+    with rec.once("automove.dry_run", items=count):
+        automove.automove("/", str(rules), dry_run=True)
+    with rec.once("automove", items=count) as info:
+        info["moved_files"] = automove.automove("/", str(rules), dry_run=False)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(
+    files: int = typer.Option(10000, "--files", help="文件数"),
+    depth: int = typer.Option(3, "--depth", help="目录层数"),
+    fanout: int = typer.Option(8, "--fanout", help="每个目录中的子目录数"),
+    tag_density: float = typer.Option(0.5, "--tag-density", help="有标签的文件比例"),
+    duplicate_ratio: float = typer.Option(
+        0.1, "--duplicate-ratio", help="重复文件比例"
+    ),
+    seed: int = typer.Option(0, "--seed", help="随机种子"),
+    repeat: int = typer.Option(5, "--repeat", help="只读测试的重复次数"),
+    workdir: Optional[Path] = typer.Option(
+        None, "--workdir", help="工作目录（默认使用临时目录，结束后删除）"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, "-o", "--output", help="结果 JSON 文件（默认输出到标准输出）"
+    ),
+):
+    """运行性能测试"""
+    config = LibraryConfig(
+        files=files,
+        depth=depth,
+        fanout=fanout,
+        tag_density=tag_density,
+        duplicate_ratio=duplicate_ratio,
+        seed=seed,
+    )
+    temporary = workdir is None
+    root = (
+        Path(tempfile.mkdtemp(prefix="atagspace-bench-"))
+        if workdir is None
+        else workdir
+    )
+    logging.getLogger("atagspace").setLevel(logging.WARNING)
+    rec = Recorder(repeat)
+    try:
+        # 进度条输出到标准错误，标准输出只有结果
+        with redirect_stdout(sys.stderr):
+            library = generate_library(root / "base", config)
+            db.close()
+            bench_update(rec, root / "base", root)
+            bench_list(rec)
+            bench_web(rec)
+            bench_extensions(rec, root, config)
+    finally:
+        db.close()
+        if temporary:
+            shutil.rmtree(root, ignore_errors=True)
+    report = {
+        "revision": git_revision(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "library": library,
+        "results": rec.results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output is None:
+        print(text)
+    else:
+        output.write_text(text + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    typer.run(main)
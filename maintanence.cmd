@@ -1,5 +1,15 @@
 call conda activate atagspace
-python app.py tagfile updatenew
+rem -i misses in-place edits, so do a full scan every 7th run
+set /a updatenew_count=0
+if exist updatenew_count.txt set /p updatenew_count=<updatenew_count.txt
+set /a updatenew_count+=1
+if %updatenew_count% geq 7 (
+    python app.py tagfile updatenew
+    set updatenew_count=0
+) else (
+    python app.py tagfile updatenew -i
+)
+>updatenew_count.txt echo %updatenew_count%
 python app.py extension totag -s
 python app.py extension sorttag
 if not "%~1" == "nopause" pause
@@ -0,0 +1,65 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from atagspace import db
+from atagspace.db import File, sqlite_db
+
+
+def file_tags(id_: int) -> set[str]:
+    return {
+        tag
+        for (tag,) in sqlite_db.execute(
+            "SELECT tag FROM file_tag WHERE file_id = ?", (id_,)
+        )
+    }
+
+
+class FileTagTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        db.close()
+        db.DB_PATH = str(Path(self.tmp.name) / "atagspace.db")
+        db.init()
+
+    def tearDown(self) -> None:
+        db.close()
+        self.tmp.cleanup()
+
+    def add(self, tags: str) -> int:
+        File.add("/L/", "f", 0, 0.0, 0, 0, None, False, tags)
+        sqlite_db.commit()
+        return sqlite_db.execute("SELECT max(id) FROM file").fetchone()[0]
+
+    def test_control_characters(self) -> None:
+        tags = ["a", "b\x01c", "d\x1fe", 'q"\\t\tn\n']
+        id_ = self.add(" ".join(tags))
+        self.assertEqual(file_tags(id_), set(tags))
+
+    def test_update(self) -> None:
+        id_ = self.add("a  b")
+        self.assertEqual(file_tags(id_), {"a", "b"})
+        File.set_tags(id_, "b \x02c")
+        sqlite_db.commit()
+        self.assertEqual(file_tags(id_), {"b", "\x02c"})
+        File.set_tags(id_, "")
+        sqlite_db.commit()
+        self.assertEqual(file_tags(id_), set())
+
+    def test_refill_when_trigger_changed(self) -> None:
+        id_ = self.add("a b\x03c")
+        # 模拟旧版本的触发器和丢失的 file_tag 记录
+        sqlite_db.execute("DROP TRIGGER file_tag_insert")
+        sqlite_db.execute(
+            "CREATE TRIGGER file_tag_insert AFTER INSERT ON file BEGIN SELECT 1; END"
+        )
+        sqlite_db.execute("DELETE FROM file_tag")
+        sqlite_db.execute("PRAGMA user_version = 0")
+        sqlite_db.commit()
+        db.init()
+        self.assertEqual(file_tags(id_), {"a", "b\x03c"})
+        self.assertEqual(file_tags(self.add("x")), {"x"})
+
+
+if __name__ == "__main__":
+    unittest.main()
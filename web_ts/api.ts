@@ -4,6 +4,55 @@ async function _api(path: string, param: any) {
   ).json();
 }
 
+// 读取 NDJSON 流，每收到一批完整的行就调用 onrows
+// onrows 返回 false 时停止读取
+// 服务器读取出错时最后一行是 {"error": ...}，这时在已收到的行之后抛出异常
+async function _apiStream(
+  path: string,
+  param: any,
+  onrows: (rows: Array<any>) => boolean,
+) {
+  const resp = await fetch(path, {
+    method: "POST",
+    body: JSON.stringify({ ...param, stream: true }),
+  });
+  if (resp.body === null) {
+    return;
+  }
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+    const lines = buffer.split("\n");
+    buffer = lines.pop() ?? "";
+    const rows = lines
+      .filter((line) => line !== "")
+      .map((line) => JSON.parse(line));
+    const failed = rows.findIndex((row) => "error" in row);
+    const received = failed < 0 ? rows : rows.slice(0, failed);
+    if (received.length > 0 && !onrows(received)) {
+      await reader.cancel();
+      return;
+    }
+    if (failed >= 0) {
+      await reader.cancel();
+      throw new Error(rows[failed].error);
+    }
+    if (done) {
+      return;
+    }
+  }
+}
+
+function _listItem(item: any): APIlist[number] {
+  return {
+    ...item,
+    tags: item.tags.split(" ").filter((tag: string) => tag !== ""),
+  };
+}
+
 // TODO API Object
 type APIlist = Array<{
   id: number;
@@ -25,19 +74,37 @@ type APIcategory = Array<{
   tags: Array<{ name: string; color: string | null }>;
 }>;
 
+type APIfacet = { count: number; size: number };
+
+type APIfacets = APIfacet & {
+  tags: { [name: string]: APIfacet };
+  categories: { [name: string]: APIfacet };
+};
+
 let api = {
   list: async (param: {
     path: string;
     filter?: string;
     recurse?: boolean;
     limit?: number;
+    after?: string;
   }) => {
     let ret = await _api("/list", param);
-    return ret.map((item: any) => ({
-      ...item,
-      tags: item.tags.split(" ").filter((tag: string) => tag !== ""),
-    })) as APIlist;
+    return ret.map(_listItem) as APIlist;
   },
+  listStream: (
+    param: {
+      path: string;
+      filter?: string;
+      recurse?: boolean;
+      limit?: number;
+      after?: string;
+    },
+    onrows: (rows: APIlist) => boolean,
+  ) =>
+    _apiStream("/list", param, (rows) => onrows(rows.map(_listItem))),
+  facets: (param: { path: string; filter?: string; recurse?: boolean }) =>
+    _api("/facets", param) as Promise<APIfacets>,
   category: () => _api("/category", {}) as Promise<APIcategory>,
   set_category: (param: { name: string; color: string | null }) =>
     _api("/set_category", param) as Promise<null>,
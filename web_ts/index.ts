@@ -5,6 +5,7 @@ const elename = [
   "go",
   "filter",
   "find",
+  "more",
   "filelist",
   "category_create",
   "category_delete",
@@ -27,6 +28,7 @@ const elename = [
 ] as const;
 
 const DEFAULT_COLOR = "#C0C0C0|#FFFFFF";
+const PAGE_SIZE = 1000;
 
 function compare(a: string, b: string) {
   return a > b ? 1 : a < b ? -1 : 0;
@@ -39,6 +41,7 @@ class App {
   ele_tagsinput = this.ele.tagsinput as HTMLInputElement;
   file: APIlist = [];
   fileindex: Map<number, APIlist[number]> = new Map();
+  fileLoadSeq = 0;
   fileCheckData = new CheckData<number>(false, true);
   fileCheckGroup = new CheckGroup<number>();
   fileCheckMode = 0;
@@ -61,6 +64,8 @@ class App {
     this.ele.tag_color,
     this.ele.tag_clear,
   );
+  facets: APIfacets | null = null;
+  facetsLoadSeq = 0;
   mode: "go" | "find" = "go";
 
   constructor() {
@@ -100,6 +105,9 @@ class App {
       this.mode = "find";
       this._reload();
     };
+    this.ele.more.onclick = async () => {
+      await this.fileLoadMoreAPI();
+    };
   }
 
   _setupFileSelect() {
@@ -423,17 +431,105 @@ class App {
     let recurse = this.mode == "find";
     let path = this.ele_path.value;
     let filter = this.ele_filter.value;
-    let list = await api.list({ path, filter, recurse });
-    this.fileLoad(list);
+    // 统计和列表同时加载，不等待
+    this.facetsLoadAPI({ path, filter, recurse });
+    if (!recurse) {
+      let list = await api.list({ path, filter, recurse });
+      this.fileLoad(list);
+      this.ele.more.hidden = true;
+      return;
+    }
+    this.fileLoad([]);
+    await this.fileStreamAPI({ path, filter, recurse, limit: PAGE_SIZE });
+  }
+  async fileLoadMoreAPI() {
+    let last = this.file[this.file.length - 1];
+    if (this.mode != "find" || last === undefined) {
+      return;
+    }
+    let path = this.ele_path.value;
+    let filter = this.ele_filter.value;
+    let after = this._fullPath(last);
+    await this.fileStreamAPI({
+      path,
+      filter,
+      recurse: true,
+      limit: PAGE_SIZE,
+      after,
+    });
+  }
+  // 查找结果以流的形式逐步显示，重新加载时丢弃旧的流
+  async fileStreamAPI(param: {
+    path: string;
+    filter: string;
+    recurse: boolean;
+    limit: number;
+    after?: string;
+  }) {
+    const seq = ++this.fileLoadSeq;
+    let count = 0;
+    this.ele.more.hidden = true;
+    try {
+      await api.listStream(param, (rows) => {
+        if (seq != this.fileLoadSeq) {
+          return false;
+        }
+        count += rows.length;
+        this.fileAppend(rows);
+        return true;
+      });
+    } catch (err) {
+      // 出错时结果不完整，不能继续加载更多
+      if (seq == this.fileLoadSeq) {
+        alert(err);
+      }
+      return;
+    }
+    if (seq == this.fileLoadSeq) {
+      this.ele.more.hidden = count < param.limit;
+    }
+  }
+  // 当前路径和过滤条件下每个标签和分类的文件数，显示在标签面板中
+  async facetsLoadAPI(param: {
+    path: string;
+    filter: string;
+    recurse: boolean;
+  }) {
+    const seq = ++this.facetsLoadSeq;
+    const facets = await api.facets(param);
+    if (seq != this.facetsLoadSeq) {
+      return;
+    }
+    this.facets = facets;
+    this.facetsShow();
+  }
+  facetsShow() {
+    const facets = this.facets;
+    if (facets === null) {
+      return;
+    }
+    this.categoryCheckGroup.elist.forEach((cate) => {
+      cate.elem.dataset.count = String(
+        facets.categories[cate.name]?.count ?? 0,
+      );
+    });
+    this.tagCheckGroup.elist.forEach((tag) => {
+      tag.elem.dataset.count = String(facets.tags[tag.name]?.count ?? 0);
+    });
   }
   fileCheckClear() {
     this.fileCheckData.clear();
   }
   fileLoad(list: APIlist) {
-    this.file = list;
+    this.fileLoadSeq++;
+    this.file = [];
     this.ele.filelist.innerHTML = "";
     this.fileindex.clear();
     this.fileCheckGroup.clear();
+    this.fileAppend(list);
+  }
+  fileAppend(list: APIlist) {
+    this.file.push(...list);
     list.forEach((file) => {
       const tags: Array<HTMLElement> = [];
       const fileTagGroup = new CheckGroup<string>();
@@ -533,6 +629,7 @@ class App {
         this.tagCheckGroup.add(tagCheck);
       });
     });
+    this.facetsShow();
   }
 
   tagColorReload() {